@@ -0,0 +1,44 @@
+"""
+Times ResponseCache.set() as the cache fills up, it should stay flat however large the cache gets.
+
+Usage:
+    python benchmarks/bench_cache.py
+    python benchmarks/bench_cache.py --pages 2000 --page-kb 300
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import zillow_scraper
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=1200)
+    parser.add_argument("--page-kb", type=int, default=300, help="compressed size of each page")
+    args = parser.parse_args()
+
+    # random bytes don't compress, so each page takes page_kb in the cache
+    body = os.urandom(args.page_kb * 1024)
+    report_every = max(args.pages // 5, 1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = zillow_scraper.ResponseCache(os.path.join(directory, "cache.sqlite"))
+        print("{:>8}{:>12}{:>14}".format("pages", "cache MB", "ms per set"))
+        seconds = 0
+        for n in range(args.pages):
+            start = time.perf_counter()
+            cache.set("https://www.zillow.com/homedetails/{}_zpid/".format(n), body)
+            seconds += time.perf_counter() - start
+            if (n + 1) % report_every == 0:
+                print("{:>8}{:>12.0f}{:>14.1f}".format(n + 1, cache.total_size / 1024 ** 2, 1000 * seconds / report_every))
+                seconds = 0
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
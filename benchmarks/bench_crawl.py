@@ -0,0 +1,140 @@
+"""
+Times an end-to-end crawl (search pages, building expansion, csv output) against the offline replay server.
+
+Reports requests and listings per second, the time spent extracting the page json and the
+peak memory of each crawl. By default a SyntheticCity is crawled, pass a recording made with
+benchmarks/replay.py to replay real pages instead. With --site-max-rate the server throttles
+(and with --site-block-after blocks) crawls going faster than that, --adaptive crawls with an
+AdaptiveRateLimiter to see which rate it settles on.
+
+Usage:
+    python benchmarks/bench_crawl.py
+    python benchmarks/bench_crawl.py --listings 20000 --partition bisect tiles --max-workers 8
+    python benchmarks/bench_crawl.py --recording recording.sqlite --city manhattan-ny --partition dynamic
+    python benchmarks/bench_crawl.py --site-max-rate 50 --site-block-after 20 --adaptive
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import zillow_scraper
+from replay import RecordedPages, ReplayDriver, ReplayServer, SyntheticCity
+
+
+class ParseTimer:
+    # wraps zillow_scraper.extract_next_data to add up the time spent in it
+    def __init__(self, extract_next_data):
+        self.extract_next_data = extract_next_data
+        self.seconds = 0
+        self.calls = 0
+
+    def __call__(self, html_content):
+        start = time.perf_counter()
+        try:
+            return self.extract_next_data(html_content)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.calls += 1
+
+
+def crawl(server, city, property_type, partition, max_workers, trace_memory, adaptive=False):
+    parse_timer = ParseTimer(zillow_scraper.extract_next_data)
+    zillow_scraper.extract_next_data = parse_timer
+    if adaptive:
+        rate_limiter = zillow_scraper.AdaptiveRateLimiter(10, min_rate=1, max_rate=100000, increase=2, increase_after=10, block_pause=2, max_block_pause=30)
+    else:
+        rate_limiter = zillow_scraper.RateLimiter(100000, burst=1000)
+    driver_pool = zillow_scraper.DriverPool(driver_factory=ReplayDriver, max_drivers=max_workers)
+    server.requests = 0
+
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with tempfile.TemporaryDirectory() as output_directory:
+            start = time.perf_counter()
+            results = zillow_scraper.collect_real_estate_data(
+                [city], [property_type], output_directory=output_directory + "/", rate_limiter=rate_limiter,
+                driver_pool=driver_pool, max_workers=max_workers, partition=partition,
+            )
+            elapsed = time.perf_counter() - start
+    finally:
+        zillow_scraper.extract_next_data = parse_timer.extract_next_data
+        driver_pool.close()
+
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        # linux reports kilobytes, this is the peak of the whole process so far
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    summary = results[(city, property_type)]
+    return {
+        "status": summary["status"],
+        "seconds": elapsed,
+        "requests": server.requests,
+        "rows": summary.get("rows", 0),
+        "parse_seconds": parse_timer.seconds,
+        "parse_calls": parse_timer.calls,
+        "peak_memory": peak_memory,
+        "rate": rate_limiter.summary() if adaptive else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--listings", type=int, default=5000, help="size of the synthetic city")
+    parser.add_argument("--nested-ratio", type=float, default=0.3, help="share of synthetic listings that are buildings")
+    parser.add_argument("--recording", help="ResponseCache file recorded with benchmarks/replay.py, replaces the synthetic city")
+    parser.add_argument("--city", default="synthetic-city", help="city to crawl, the one recorded when using --recording")
+    parser.add_argument("--property-type", default="rent", choices=["rent", "sale"])
+    parser.add_argument("--partition", nargs="+", default=["dynamic", "bisect", "tiles"])
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--site-max-rate", type=float, help="requests per second the server answers before throttling with 429s")
+    parser.add_argument("--site-block-after", type=int, help="429s in a row before the server serves captcha pages for a while")
+    parser.add_argument("--adaptive", action="store_true", help="crawl with an AdaptiveRateLimiter instead of an unlimited one")
+    parser.add_argument("--trace-memory", action="store_true", help="report the peak python heap (tracemalloc, slows the crawl) instead of the peak process rss")
+    args = parser.parse_args()
+
+    site = RecordedPages(args.recording) if args.recording else SyntheticCity(args.listings, nested_ratio=args.nested_ratio)
+
+    with ReplayServer(site, max_rate=args.site_max_rate, block_after=args.site_block_after) as server:
+        zillow_scraper.base_url = server.url
+
+        results = []
+        for partition in args.partition:
+            results.append((partition, crawl(server, args.city, args.property_type, partition, args.max_workers, args.trace_memory, adaptive=args.adaptive)))
+
+    print()
+    print("{:<10}{:>8}{:>10}{:>10}{:>12}{:>10}{:>14}{:>14}{:>12}".format(
+        "partition", "status", "seconds", "requests", "requests/s", "rows", "listings/s", "parse ms/page", "peak MB"))
+    for partition, result in results:
+        print("{:<10}{:>8}{:>10.2f}{:>10}{:>12.1f}{:>10}{:>14.1f}{:>14.2f}{:>12.1f}".format(
+            partition,
+            result["status"],
+            result["seconds"],
+            result["requests"],
+            result["requests"] / result["seconds"],
+            result["rows"],
+            result["rows"] / result["seconds"],
+            1000 * result["parse_seconds"] / max(result["parse_calls"], 1),
+            result["peak_memory"] / 1024 ** 2,
+        ))
+
+    if args.adaptive:
+        print()
+        print("{:<10}{:>14}{:>14}{:>14}  {}".format("partition", "final rate", "sustainable", "achieved", "responses"))
+        for partition, result in results:
+            rate = result["rate"]
+            print("{:<10}{:>14.1f}{:>14}{:>14.1f}  {}".format(
+                partition, rate["requests_per_second"], "-" if rate["sustainable_rate"] is None else "{:.1f}".format(rate["sustainable_rate"]), rate["achieved_rate"], rate["outcomes"]))
+
+
+if __name__ == "__main__":
+    main()
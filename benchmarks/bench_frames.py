@@ -0,0 +1,98 @@
+"""
+Compares the single-pass frame builders against the old row-by-row pd.concat approach,
+and the memory a sales frame keeps alive with and without the sale_schema projection.
+
+Usage:
+    python benchmarks/bench_frames.py
+"""
+import os
+import gc
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import zillow_scraper
+from fixtures import make_data_list
+
+
+def make_frame_sales_per_row(frame, data_list):
+    # the previous implementation, kept here as the baseline
+    for i in data_list:
+        for item in zillow_scraper.get_list_results(i):
+            frame = pd.concat([frame, pd.DataFrame([item])], ignore_index=True)
+    return frame
+
+
+def make_frame_rentals_detail_per_row(frame, data_list):
+    for i in data_list:
+        for item in zillow_scraper.get_list_results(i):
+            try:
+                frame = pd.concat([frame, pd.DataFrame([zillow_scraper.rental_detail_record(item)])], ignore_index=True)
+            except:
+                pass
+    return frame
+
+
+def time_builder(builder, data_list):
+    start = time.perf_counter()
+    frame = builder(pd.DataFrame(), data_list)
+    return time.perf_counter() - start, len(frame)
+
+
+def make_frame_sales_unprojected(frame, data_list):
+    # the search results as they come, minus hdpData, like sales used to be flattened
+    records = [
+        {key: value for key, value in item.items() if key != "hdpData"}
+        for i in data_list for item in zillow_scraper.get_list_results(i)
+    ]
+    return zillow_scraper.append_records(frame, records)
+
+
+def retained_memory(builder, size):
+    # memory still held by the frame once the search pages it was built from are gone
+    tracemalloc.start()
+    data_list = make_data_list(size)
+    frame = builder(pd.DataFrame(), data_list)
+    del data_list
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del frame
+    return retained
+
+
+def main():
+    sizes = [1000, 10000, 100000]
+    # the per-row builders are quadratic, don't bother running them on the largest size
+    max_per_row_size = 10000
+
+    builders = [
+        ("make_frame_sales", zillow_scraper.make_frame_sales, make_frame_sales_per_row),
+        ("make_frame_rentals_detail", zillow_scraper.make_frame_rentals_detail, make_frame_rentals_detail_per_row),
+        ("make_frame_rentals", zillow_scraper.make_frame_rentals, None),
+    ]
+
+    print("{:<28}{:>10}{:>10}{:>14}{:>14}".format("builder", "listings", "rows", "single-pass", "per-row"))
+    for size in sizes:
+        data_list = make_data_list(size)
+        for name, builder, per_row_builder in builders:
+            elapsed, rows = time_builder(builder, data_list)
+            per_row = "-"
+            if per_row_builder is not None and size <= max_per_row_size:
+                per_row = "{:.3f}s".format(time_builder(per_row_builder, data_list)[0])
+            print("{:<28}{:>10}{:>10}{:>14}{:>14}".format(name, size, rows, "{:.3f}s".format(elapsed), per_row))
+
+    print()
+    print("{:<28}{:>10}{:>14}{:>14}".format("sales frame memory", "listings", "projected", "unprojected"))
+    for size in sizes[:2]:
+        projected = retained_memory(zillow_scraper.make_frame_sales, size)
+        unprojected = retained_memory(make_frame_sales_unprojected, size)
+        print("{:<28}{:>10}{:>14}{:>14}".format("", size, "{:.1f}MB".format(projected / 1024 ** 2), "{:.1f}MB".format(unprojected / 1024 ** 2)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Compares the sliced __NEXT_DATA__ extraction against parsing the whole page with BeautifulSoup.
+
+Usage:
+    python benchmarks/bench_next_data.py [saved_page.html ...]
+
+Without arguments a synthetic search page is used.
+"""
+import json
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import zillow_scraper
+from fixtures import make_search_html, make_search_page
+
+
+def extract_with_soup(html_content):
+    # the previous implementation, kept here as the baseline
+    soup = BeautifulSoup(html_content, 'html.parser')
+    script_tag = soup.find('script', {'id': '__NEXT_DATA__'})
+    return json.loads(script_tag.string) if script_tag else None
+
+
+def best_of(func, arg, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    pages = []
+    for path in sys.argv[1:]:
+        with open(path, "rb") as f:
+            pages.append((os.path.basename(path), f.read()))
+
+    if not pages:
+        html = make_search_html(make_search_page(0, 41)).encode("utf-8")
+        pages.append(("synthetic", html))
+
+    print("{:<30}{:>10}{:>14}{:>14}{:>10}".format("page", "size", "sliced", "soup", "speedup"))
+    for name, html in pages:
+        sliced_time, sliced = best_of(zillow_scraper.extract_next_data, html, repeat=5)
+        soup_time, souped = best_of(extract_with_soup, html.decode("utf-8", errors="replace"), repeat=3)
+        if sliced != souped:
+            print("warning: {} extracted different json".format(name))
+        print("{:<30}{:>10}{:>14}{:>14}{:>10}".format(
+            name[:29],
+            "{:.1f}MB".format(len(html) / 1e6),
+            "{:.4f}s".format(sliced_time),
+            "{:.4f}s".format(soup_time),
+            "{:.0f}x".format(soup_time / sliced_time),
+        ))
+
+
+if __name__ == "__main__":
+    main()
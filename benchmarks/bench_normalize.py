@@ -0,0 +1,95 @@
+"""
+Compares normalize_frame() against converting the same columns one value at a time in python.
+
+Usage:
+    python benchmarks/bench_normalize.py
+"""
+import datetime
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import zillow_scraper
+
+
+def make_rental_rows(num_rows, seed=0):
+    # expanded rental rows as collect_real_estate_data() writes them, unit prices still scraped strings
+    rng = random.Random(seed)
+    rows = []
+    for n in range(num_rows):
+        price = rng.randint(1500, 15000)
+        rows.append({
+            "unit_description": "Apartment for rent",
+            "detailed_url": "/b/building-{}/".format(n // 4),
+            "latitude": 40.7 + rng.random() / 10,
+            "longitude": -74.0 + rng.random() / 10,
+            "unit_address": "{} Broadway, New York, NY".format(n),
+            "unit_city": rng.choice(["New York", "Brooklyn", "Queens"]),
+            "unit_zipcode": str(rng.choice([10001, 10002, 10003, 10011, 10128, 11201])),
+            "beds": rng.choice([0, 1, 2, 3, "2", "1", None]),
+            "baths": rng.choice([1, 1.5, 2, "1", None]),
+            "area": rng.choice([rng.randint(400, 2000), None]),
+            "price": rng.choice([float(price), "${:,}".format(price), "${:,}+".format(price), "${:,}/mo".format(price)]),
+            "unit_number": str(n % 40),
+            "available_from": rng.choice([str(1700000000000 + 86400000 * rng.randint(0, 90)), None]),
+        })
+    return pd.DataFrame.from_records(rows)
+
+
+def to_number(value):
+    if value is None or value != value:
+        return None
+    try:
+        return zillow_scraper.parse_price(value)
+    except TypeError:
+        return None
+
+
+def to_date(value):
+    if value is None or value != value:
+        return None
+    return datetime.datetime.utcfromtimestamp(int(value) / 1000)
+
+
+def normalize_per_value(frame):
+    # the same conversions, but through a python function call per value
+    frame = frame.copy()
+    for column in ["price"]:
+        frame[column] = frame[column].map(to_number)
+    for column in ["beds", "area"]:
+        frame[column] = frame[column].map(lambda value: None if to_number(value) is None else int(round(to_number(value))))
+    frame["baths"] = frame["baths"].map(to_number)
+    for column in ["latitude", "longitude"]:
+        frame[column] = frame[column].map(float)
+    for column in ["unit_city", "unit_zipcode"]:
+        frame[column] = frame[column].map(lambda value: None if value is None else str(value))
+    frame["available_from"] = frame["available_from"].map(to_date)
+    return frame
+
+
+def main():
+    num_rows = 100000
+    frame = make_rental_rows(num_rows)
+
+    start = time.perf_counter()
+    per_value = normalize_per_value(frame)
+    per_value_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = zillow_scraper.normalize_frame(frame)
+    vectorized_seconds = time.perf_counter() - start
+
+    columns = ["price", "beds", "baths", "area", "latitude", "longitude", "unit_city", "unit_zipcode", "available_from"]
+    print("{:<14}{:>10}{:>12}{:>14}".format("", "rows", "seconds", "memory"))
+    for name, seconds, result in [("scraped", None, frame), ("per-value", per_value_seconds, per_value), ("vectorized", vectorized_seconds, vectorized)]:
+        memory = result[columns].memory_usage(deep=True, index=False).sum()
+        print("{:<14}{:>10}{:>12}{:>14}".format(name, len(result), "-" if seconds is None else "{:.3f}s".format(seconds), "{:.1f}MB".format(memory / 1024 ** 2)))
+
+
+if __name__ == "__main__":
+    main()
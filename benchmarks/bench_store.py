@@ -0,0 +1,87 @@
+"""
+Times ListingStore upserts and price lookups against scanning the dated csv files for the same answer.
+
+Usage:
+    python benchmarks/bench_store.py
+    python benchmarks/bench_store.py --listings 50000 --days 30
+"""
+import argparse
+import glob
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import zillow_scraper
+
+
+def make_sale_frame(num_listings, day, rng):
+    # a day of sale listings, a few percent of them changing price each day
+    return pd.DataFrame({
+        "zpid": [str(10000000 + n) for n in range(num_listings)],
+        "detailUrl": ["https://www.zillow.com/homedetails/{}_zpid/".format(10000000 + n) for n in range(num_listings)],
+        "statusType": ["FOR_SALE"] * num_listings,
+        "unformattedPrice": [float(500000 + 1000 * n + (5000 * day if rng.random() < 0.05 else 0)) for n in range(num_listings)],
+        "addressZipcode": [str(10001 + n % 40) for n in range(num_listings)],
+        "latitude": [40.7 + rng.random() / 10 for n in range(num_listings)],
+        "longitude": [-74.0 + rng.random() / 10 for n in range(num_listings)],
+        "beds": [n % 5 for n in range(num_listings)],
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--listings", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        store = zillow_scraper.ListingStore(os.path.join(directory, "listings.sqlite"))
+        upsert_seconds = 0
+        for day in range(args.days):
+            scrape_date = (pd.Timestamp("2026-01-01") + pd.Timedelta(days=day)).strftime("%Y-%m-%d")
+            frame = make_sale_frame(args.listings, day, rng)
+            frame.to_csv(os.path.join(directory, "city_sale_{}.csv".format(scrape_date)))
+            start = time.perf_counter()
+            store.write(frame, "city", "sale", scrape_date)
+            upsert_seconds += time.perf_counter() - start
+
+        zpid = str(10000000 + args.listings // 2)
+        date = (pd.Timestamp("2026-01-01") + pd.Timedelta(days=args.days // 2)).strftime("%Y-%m-%d")
+
+        lookups = 1000
+        start = time.perf_counter()
+        for _ in range(lookups):
+            price = store.price_on(zpid, date)
+        store_seconds = (time.perf_counter() - start) / lookups
+
+        # the same answer from the csv files: the latest file on or before the date that has the listing
+        start = time.perf_counter()
+        csv_price = None
+        for path in sorted(glob.glob(os.path.join(directory, "city_sale_*.csv"))):
+            if path[-14:-4] > date:
+                break
+            frame = pd.read_csv(path, dtype={"zpid": str})
+            prices = frame.loc[frame["zpid"] == zpid, "unformattedPrice"]
+            if len(prices):
+                csv_price = prices.iloc[0]
+        csv_seconds = time.perf_counter() - start
+
+        history_rows = store.query("SELECT COUNT(*) AS n FROM listing_history")["n"][0]
+        store.close()
+
+    rows = args.listings * args.days
+    print("{} listings x {} days, {} history rows".format(args.listings, args.days, history_rows))
+    print("{:<24}{:>14}".format("upsert rows/s", "{:,.0f}".format(rows / upsert_seconds)))
+    print("{:<24}{:>14}{:>14}".format("price on " + date, "{:.3f}ms".format(1000 * store_seconds), price))
+    print("{:<24}{:>14}{:>14}".format("csv scan", "{:.3f}ms".format(1000 * csv_seconds), csv_price))
+
+
+if __name__ == "__main__":
+    main()
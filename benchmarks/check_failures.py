@@ -0,0 +1,129 @@
+"""
+Checks how crawls against the offline replay server cope with pages failing halfway through.
+
+    - units of building pages that 404 aren't stored in the delta snapshot, the next
+      delta run fetches those buildings again
+    - a crawl stopping on a search page that 404s reports "partial" and keeps its journal
+    - resuming that crawl writes the same rows as a crawl that never failed
+
+Exits with an AssertionError on the first check that fails.
+
+Usage:
+    python benchmarks/check_failures.py
+    python benchmarks/check_failures.py --listings 2000
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import tempfile
+import urllib.parse
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import zillow_scraper
+from replay import ReplayDriver, ReplayServer, SyntheticCity
+
+
+class FailingSite:
+    """
+    A site whose missing_paths, and its fail_search_page-th search page request (once), are 404s.
+    """
+
+    def __init__(self, site, missing_paths=(), fail_search_page=None):
+        self.site = site
+        self.missing_paths = set(missing_paths)
+        self.fail_search_page = fail_search_page
+        self.search_pages = 0
+
+    def get(self, url):
+        path = urllib.parse.urlsplit(url).path
+        if path in self.missing_paths:
+            return None
+        if path not in self.site.buildings and not re.match(r"/homedetails/", path):
+            self.search_pages += 1
+            if self.search_pages == self.fail_search_page:
+                return None
+        return self.site.get(url)
+
+
+def crawl(server, output_directory, property_type, **kwargs):
+    os.makedirs(output_directory, exist_ok=True)
+    zillow_scraper.base_url = server.url
+    results = zillow_scraper.collect_real_estate_data(
+        ["synthetic-city"], [property_type], output_directory=output_directory,
+        rate_limiter=zillow_scraper.RateLimiter(100000, burst=1000),
+        driver_pool=zillow_scraper.DriverPool(driver_factory=ReplayDriver), **kwargs)
+    return results[("synthetic-city", property_type)]
+
+
+def read_rows(output_directory, property_type, key):
+    # the rows of the dated csv of a crawl, in a stable order
+    frame = pd.read_csv(glob.glob(os.path.join(output_directory, "synthetic-city_{}_*.csv".format(property_type)))[0], index_col=0, dtype=str)
+    return frame.sort_values(key).reset_index(drop=True)
+
+
+def check_failed_expansions(city, directory):
+    missing_paths = sorted(city.buildings)[:5]
+    site = FailingSite(city, missing_paths=missing_paths)
+    output_directory = os.path.join(directory, "expansions") + os.sep
+    snapshot_path = zillow_scraper.snapshot_path(output_directory, "synthetic-city", "rent")
+
+    with ReplayServer(site) as server:
+        crawl(server, output_directory, "rent", delta=True)
+        stored = zillow_scraper.SnapshotStore(snapshot_path).units
+        assert len(stored) == len(city.buildings) - len(missing_paths), "{} of {} buildings stored".format(len(stored), len(city.buildings))
+        assert not [url for url in stored if urllib.parse.urlsplit(url).path in missing_paths], "failed expansions were stored"
+
+        site.missing_paths = set()
+        summary = crawl(server, output_directory, "rent", delta=True)
+        refetched = [url for url in summary["fetch_tiers"] if urllib.parse.urlsplit(url).path in missing_paths]
+        assert len(refetched) == len(missing_paths), "{} of {} failed buildings fetched again".format(len(refetched), len(missing_paths))
+        stored = zillow_scraper.SnapshotStore(snapshot_path).units
+        assert len(stored) == len(city.buildings), "{} of {} buildings stored after the rerun".format(len(stored), len(city.buildings))
+    print("failed expansions: not stored, fetched again by the next delta run")
+
+
+def check_resume(city, directory):
+    clean_directory = os.path.join(directory, "clean") + os.sep
+    resumed_directory = os.path.join(directory, "resumed") + os.sep
+    journal_path = zillow_scraper.checkpoint_path(resumed_directory, "synthetic-city", "sale")
+
+    site = FailingSite(city)
+    with ReplayServer(site) as server:
+        crawl(server, clean_directory, "sale")
+
+        # the next crawl gets a 404 about halfway through its search pages
+        site.search_pages = 0
+        site.fail_search_page = len(city.listings) // (2 * city.page_size)
+        summary = crawl(server, resumed_directory, "sale", resume=True)
+        assert summary["status"] == "partial", "errored crawl reported {}".format(summary["status"])
+        assert os.path.exists(journal_path), "errored crawl removed its journal"
+        print("errored crawl: reported partial after {} rows, journal kept".format(summary["rows"]))
+
+        summary = crawl(server, resumed_directory, "sale", resume=True)
+        assert summary["status"] == "done", "resumed crawl reported {}".format(summary["status"])
+        assert not os.path.exists(journal_path), "finished crawl kept its journal"
+
+    clean_rows = read_rows(clean_directory, "sale", "zpid")
+    resumed_rows = read_rows(resumed_directory, "sale", "zpid")
+    pd.testing.assert_frame_equal(clean_rows, resumed_rows)
+    print("resumed crawl: same {} rows as a clean crawl".format(len(clean_rows)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--listings", type=int, default=1000)
+    args = parser.parse_args()
+
+    city = SyntheticCity(args.listings)
+    with tempfile.TemporaryDirectory() as directory:
+        check_failed_expansions(city, directory)
+        check_resume(city, directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# synthetic zillow search pages used by the benchmarks
+import random
+
+
+def make_listing(n, nested=False, rng=random):
+    price = rng.randint(1500, 15000)
+    listing = {
+        "zpid": str(10000000 + n),
+        "id": str(10000000 + n),
+        "statusText": "Apartment for rent",
+        "statusType": "FOR_RENT",
+        "detailUrl": "/b/building-{n}/".format(n=n) if nested else "https://www.zillow.com/homedetails/{n}_zpid/".format(n=n),
+        "imgSrc": "https://photos.zillowstatic.com/fp/{n}-p_e.jpg".format(n=n),
+        "address": "{n} Broadway APT {n}, New York, NY 10001".format(n=n),
+        "addressStreet": "{n} Broadway APT {n}".format(n=n),
+        "addressCity": "New York",
+        "addressState": "NY",
+        "addressZipcode": str(rng.choice([10001, 10002, 10003, 10011, 10128])),
+        "isFeaturedListing": False,
+        "latLong": {"latitude": 40.7 + rng.random() / 10, "longitude": -74.0 + rng.random() / 10},
+        "carouselPhotos": [{"url": "https://photos.zillowstatic.com/fp/{n}-{i}.jpg".format(n=n, i=i)} for i in range(5)],
+        "hdpData": {"homeInfo": {"zpid": 10000000 + n, "price": price, "homeType": "APARTMENT", "zipcode": "10001", "city": "New York"}},
+        "variableData": {"type": "TIME_ON_INFO", "text": "1 day ago"},
+        "zestimate": None,
+    }
+
+    if nested:
+        listing["units"] = [
+            {"price": "${:,}+".format(price + 250 * i), "beds": str(i), "roomForRent": False}
+            for i in range(rng.randint(1, 4))
+        ]
+    else:
+        listing.update({
+            "price": "${:,}/mo".format(price),
+            "unformattedPrice": price,
+            "beds": rng.randint(0, 4),
+            "baths": rng.randint(1, 3),
+            "area": rng.randint(400, 2000),
+        })
+
+    return listing
+
+
+def make_search_page(start, num_listings, nested_ratio=0.3, total_results=None, rng=random):
+    list_results = [make_listing(n, nested=rng.random() < nested_ratio, rng=rng) for n in range(start, start + num_listings)]
+    return {
+        "props": {
+            "pageProps": {
+                "searchPageState": {
+                    "cat1": {
+                        "searchResults": {"listResults": list_results, "mapResults": []},
+                        "searchList": {"totalResultCount": total_results or num_listings, "totalPages": 1},
+                    }
+                }
+            }
+        }
+    }
+
+
+def make_data_list(num_listings, page_size=41, nested_ratio=0.3, seed=0):
+    rng = random.Random(seed)
+    data_list = []
+    for start in range(0, num_listings, page_size):
+        data_list.append(make_search_page(start, min(page_size, num_listings - start), nested_ratio=nested_ratio, rng=rng))
+    return data_list
+
+
+def make_search_html(data, filler_elements=20000):
+    # wraps a __NEXT_DATA__ document in enough markup to look like a real zillow page
+    import json
+
+    filler = "\n".join(
+        '<div class="list-card"><a href="/homedetails/{n}_zpid/"><span class="price">${n}</span></a></div>'.format(n=n)
+        for n in range(filler_elements)
+    )
+    return (
+        '<!DOCTYPE html><html><head><title>Zillow</title>'
+        '<script>window.__NEXT_DATA__ = window.__NEXT_DATA__ || {{}};</script></head>'
+        '<body><div id="__next">{filler}</div>'
+        '<script id="__NEXT_DATA__" type="application/json">{data}</script>'
+        '</body></html>'
+    ).format(filler=filler, data=json.dumps(data))
@@ -0,0 +1,323 @@
+"""
+Offline stand-in for zillow.com: a local http server serving either recorded pages or a synthetic city.
+
+Recording is done with the scraper's own ResponseCache, every page a crawl fetches (plain
+http or through the browser) ends up in it keyed on its url:
+
+    python benchmarks/replay.py record manhattan-ny rent recording.sqlite
+
+ReplayServer then answers the scraper's requests from that file, or from a SyntheticCity
+generated from the benchmark fixtures, once zillow_scraper.base_url points at it. ReplayDriver
+is a WebDriver stand-in fetching from the server, for DriverPool(driver_factory=ReplayDriver).
+
+    with ReplayServer(SyntheticCity(5000)) as server:
+        zillow_scraper.base_url = server.url
+        ...
+"""
+import ast
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import zillow_scraper
+from fixtures import make_listing, make_search_html
+
+zillow_url = "https://www.zillow.com"
+
+
+def parse_search_query_state(url):
+    # the searchQueryState of a search url, either json or the python dict repr zillow_url_constructor() used to send
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    if "searchQueryState" not in query:
+        return {}
+    value = query["searchQueryState"][0]
+    try:
+        return json.loads(value)
+    except ValueError:
+        return ast.literal_eval(value.replace("true", "True").replace("false", "False"))
+
+
+# filterState flag hiding each hdpData homeType
+home_type_flags = {"SINGLE_FAMILY": "sf", "TOWNHOUSE": "tow", "MULTI_FAMILY": "mf", "CONDO": "con", "APARTMENT": "apa", "MANUFACTURED": "manu", "LOT": "land"}
+
+
+def in_range(value, bounds):
+    return value is None or (value >= bounds.get("min", value) and value <= bounds.get("max", value))
+
+
+def listing_price(listing):
+    if "unformattedPrice" in listing:
+        return listing["unformattedPrice"]
+    return float(listing["units"][0]["price"].replace("$", "").replace(",", "").replace("+", ""))
+
+
+class SyntheticCity:
+    """
+    A city of num_listings rentals, searched the way zillow does.
+
+    Search pages are sorted by price, filtered on the price, beds, baths, sqft, home type
+    and mapBounds of the searchQueryState, hold page_size listings and stop after max_pages. Building pages
+    (/b/...) have a floor plan per unit and listing pages (/homedetails/...) a monthlyHoaFee.
+
+    Arguments:
+        num_listings (int): size of the city
+        nested_ratio (float): share of listings that are buildings with several units
+        page_size (int): listings per search page
+        max_pages (int): pages zillow serves for a single search
+        filler_elements (int): markup added around the json, see make_search_html()
+        seed (int): seed of the listings
+    """
+
+    def __init__(self, num_listings=5000, nested_ratio=0.3, page_size=41, max_pages=20, filler_elements=2000, seed=0):
+        rng = random.Random(seed)
+        self.listings = sorted(
+            (make_listing(n, nested=rng.random() < nested_ratio, rng=rng) for n in range(num_listings)),
+            key=listing_price,
+        )
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.filler_elements = filler_elements
+        self.buildings = {listing["detailUrl"]: listing for listing in self.listings if "units" in listing}
+        latitudes = [listing["latLong"]["latitude"] for listing in self.listings]
+        longitudes = [listing["latLong"]["longitude"] for listing in self.listings]
+        self.map_bounds = {"west": min(longitudes), "east": max(longitudes), "south": min(latitudes), "north": max(latitudes)}
+
+    def search(self, query_state):
+        filter_state = query_state.get("filterState", {})
+        price = filter_state.get("price", {})
+        min_price = price.get("min") or 0
+        max_price = price.get("max")
+        bounds = query_state.get("mapBounds")
+
+        results = []
+        for listing in self.listings:
+            value = listing_price(listing)
+            if value < min_price or (max_price is not None and value > max_price):
+                continue
+            if filter_state.get(home_type_flags.get(listing["hdpData"]["homeInfo"]["homeType"]), {}).get("value", True) is False:
+                continue
+            if "units" in listing:
+                # a building matches when one of its units does
+                if not any(in_range(int(unit["beds"]), filter_state.get("beds", {})) for unit in listing["units"]):
+                    continue
+            elif not (in_range(listing["beds"], filter_state.get("beds", {})) and in_range(listing["baths"], filter_state.get("baths", {})) and in_range(listing["area"], filter_state.get("sqft", {}))):
+                continue
+            if bounds is not None:
+                lat_long = listing["latLong"]
+                if not (bounds["south"] <= lat_long["latitude"] <= bounds["north"] and bounds["west"] <= lat_long["longitude"] <= bounds["east"]):
+                    continue
+            results.append(listing)
+        return results
+
+    def search_page(self, url, pg_num):
+        query_state = parse_search_query_state(url)
+        results = self.search(query_state)
+        page = results[(pg_num - 1) * self.page_size:pg_num * self.page_size] if pg_num <= self.max_pages else []
+
+        data = {
+            "props": {
+                "pageProps": {
+                    "searchPageState": {
+                        "queryState": {"mapBounds": query_state.get("mapBounds") or self.map_bounds},
+                        "cat1": {
+                            "searchResults": {"listResults": page, "mapResults": []},
+                            "searchList": {"totalResultCount": len(results), "totalPages": min(self.max_pages, -(-len(results) // self.page_size))},
+                        },
+                    }
+                }
+            }
+        }
+        html = make_search_html(data, filler_elements=self.filler_elements)
+        return html.replace("<body>", '<body><span class="result-count">{:,} results</span>'.format(len(results)), 1)
+
+    def building_page(self, listing):
+        floor_plans = [
+            {
+                "beds": int(unit["beds"]),
+                "baths": 1,
+                "units": [{"unitNumber": str(i + 1), "price": unit["price"].replace("+", ""), "sqft": 500 + 150 * i, "availableFrom": "1700000000000"}],
+            }
+            for i, unit in enumerate(listing["units"])
+        ]
+        data = {"props": {"pageProps": {"componentProps": {"initialReduxState": {"gdp": {"building": {"floorPlans": floor_plans}}}}}}}
+        return '<html><body><script id="__NEXT_DATA__" type="application/json">{}</script></body></html>'.format(json.dumps(data))
+
+    def listing_page(self, zpid):
+        cache = json.dumps({"ForSaleShopperPlatformFullRenderQuery": {"property": {"zpid": zpid, "monthlyHoaFee": (zpid % 7) * 100 or None}}})
+        data = {"props": {"pageProps": {"componentProps": {"gdpClientCache": cache}}}}
+        return '<html><body><script id="__NEXT_DATA__" type="application/json">{}</script></body></html>'.format(json.dumps(data))
+
+    def get(self, url):
+        path = urllib.parse.urlsplit(url).path
+        if path in self.buildings:
+            return self.building_page(self.buildings[path]).encode("utf-8")
+
+        match = re.match(r"/homedetails/(\d+)_zpid/", path)
+        if match:
+            return self.listing_page(int(match.group(1))).encode("utf-8")
+
+        match = re.search(r"/(\d+)_p/$", path)
+        return self.search_page(url, int(match.group(1)) if match else 1).encode("utf-8")
+
+
+class RecordedPages:
+    """
+    Pages recorded in a ResponseCache (see record()), looked up by their zillow.com url.
+    """
+
+    def __init__(self, path):
+        self.cache = zillow_scraper.ResponseCache(path, ttl=None, max_bytes=float("inf"))
+
+    def get(self, url):
+        parts = urllib.parse.urlsplit(url)
+        return self.cache.get(zillow_url + urllib.parse.urlunsplit(("", "", parts.path, parts.query, "")))
+
+
+captcha_page = b'<html><body><h1>Access to this page has been denied</h1><div id="px-captcha"></div></body></html>'
+
+
+class ReplayServer:
+    """
+    Serves the pages of site (SyntheticCity or RecordedPages) on a local port, unknown pages are 404s.
+
+    Links to zillow.com in the pages served are rewritten to the server's url. With max_rate,
+    the server behaves like a site protecting itself: requests beyond max_rate per second get
+    a 429, and after block_after of those in a row every request gets a captcha page for
+    block_seconds.
+
+    Attributes:
+        url (str): base url to set zillow_scraper.base_url to
+        requests (int): number of requests served
+        bytes_served (int): size of the pages served
+        throttled (int): number of 429s served
+        blocked (int): number of captcha pages served
+    """
+
+    def __init__(self, site, host="127.0.0.1", port=0, max_rate=None, block_after=None, block_seconds=5):
+        self.site = site
+        self.requests = 0
+        self.bytes_served = 0
+        self.max_rate = max_rate
+        self.block_after = block_after
+        self.block_seconds = block_seconds
+        self.throttled = 0
+        self.blocked = 0
+        self.tokens = max_rate or 0
+        self.refilled = time.monotonic()
+        self.throttled_in_a_row = 0
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                admission = server.admit()
+                if admission == "throttled":
+                    self.send_error(429)
+                    return
+                if admission == "blocked":
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/html; charset=utf-8")
+                    self.send_header("Content-Length", str(len(captcha_page)))
+                    self.end_headers()
+                    self.wfile.write(captcha_page)
+                    return
+
+                body = server.site.get(self.path)
+                if body is not None:
+                    # absolute links (ie. the detailUrl of a sale) lead back to the server
+                    body = body.replace(zillow_url.encode("utf-8"), server.url.encode("utf-8"))
+                with server.lock:
+                    server.requests += 1
+                    server.bytes_served += len(body or b"")
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = "http://{}:{}".format(*self.httpd.server_address)
+        self.thread = None
+
+    def admit(self):
+        # "ok", "throttled" or "blocked", a token bucket of max_rate requests per second holding up to a second's worth
+        if self.max_rate is None:
+            return "ok"
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                self.blocked += 1
+                return "blocked"
+            self.tokens = min(self.max_rate, self.tokens + (now - self.refilled) * self.max_rate)
+            self.refilled = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.throttled_in_a_row = 0
+                return "ok"
+            self.throttled_in_a_row += 1
+            if self.block_after is not None and self.throttled_in_a_row >= self.block_after:
+                self.throttled_in_a_row = 0
+                self.blocked_until = now + self.block_seconds
+                self.blocked += 1
+                return "blocked"
+            self.throttled += 1
+            return "throttled"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class ReplayDriver:
+    # the parts of a selenium WebDriver DriverPool uses, fetching pages from the replay server
+    def __init__(self):
+        self.page_source = ""
+
+    def get(self, url):
+        with urllib.request.urlopen(url) as response:
+            self.page_source = response.read().decode("utf-8")
+
+    def quit(self):
+        pass
+
+
+def record(city, property_type, path, **kwargs):
+    # crawls zillow.com for real, keeping every page fetched in the ResponseCache at path
+    cache = zillow_scraper.ResponseCache(path, ttl=None, max_bytes=float("inf"))
+    zillow_scraper.collect_real_estate_data([city], [property_type], cache=cache, **kwargs)
+    cache.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 5 or sys.argv[1] != "record":
+        print("Usage: python benchmarks/replay.py record <city> <rent|sale> <recording.sqlite>")
+        sys.exit(1)
+    record(sys.argv[2], sys.argv[3], sys.argv[4])
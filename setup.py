@@ -9,6 +9,9 @@ setup(
         'bs4>=0.0.1',
         'pandas>=1.1.5',
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
     author='Hansen Han',
     author_email='hansenrjhan@gmail.com',
     description='A package for scraping Zillow data'
@@ -8,6 +8,19 @@ import math
 import re
 import time
 import urllib.parse
+import email.utils
+import hashlib
+import os
+import sqlite3
+import zlib
+import random
+import threading
+import atexit
+import logging
+import functools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 import traceback
 
@@ -15,115 +28,470 @@ import traceback
 
 # set config
 warnings.filterwarnings('ignore')
+logger = logging.getLogger("zillow_scraper")
 
 headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
     "Accept-Language": "en-US,en;q=0.9",
 }
 
+# every search, building and listing page is requested from here, the benchmarks point it at a local replay server
+base_url = "https://www.zillow.com"
+
+# statuses worth retrying, any other non-200 response fails immediately
+retry_status_codes = [429, 500, 502, 503, 504]
+
+# zillow's bot protection answers with a 403, or a 200 captcha page, instead of the listings
+block_status_codes = [403]
+block_markers = [b"px-captcha", b"captchaPerimeterX", b"Access to this page has been denied"]
+
+
+# column layouts of the frames built from the search results
+rental_columns = [
+    "description", "latitude", "price", "beds", "longitude", "featured",
+    "address", "address_street", "city", "zipcode", "img",
+]
+
+rental_detail_columns = [
+    "listing_type", "unit_description", "detailed_url", "latitude", "longitude",
+    "unit_address", "unit_address_street", "unit_city", "unit_zipcode",
+    "beds", "baths", "area", "price", "unit_number",
+]
+
+unit_columns = ["unit_number", "price", "sqft", "baths", "beds", "available_from"]
+
+
+number_pattern = r"(\d[\d,]*(?:\.\d+)?)"
+
+
+def parse_price(value):
+    # "$1,234+", "$3,000/mo", "$150,000.00" -> float, numbers pass through
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(number_pattern, value)
+    if match is None:
+        return None
+    return float(match.group(0).replace(",", ""))
+
+
+def to_json(value):
+    # keeps a nested value as a json string column instead of a python object
+    return json.dumps(value)
+
+
+# the columns of a sale listing: column -> path of the field in the search result ("a.b" is item["a"]["b"]) and how to coerce it
+# everything else (hdpData, carouselPhotos, variableData, ...) is never copied out of the page json
+sale_schema = [
+    ("zpid", "zpid", str),
+    ("id", "id", str),
+    ("providerListingId", "providerListingId", str),
+    ("imgSrc", "imgSrc", str),
+    ("detailUrl", "detailUrl", str),
+    ("statusType", "statusType", str),
+    ("statusText", "statusText", str),
+    ("countryCurrency", "countryCurrency", str),
+    ("price", "price", str),
+    ("unformattedPrice", "unformattedPrice", parse_price),
+    ("address", "address", str),
+    ("addressStreet", "addressStreet", str),
+    ("addressCity", "addressCity", str),
+    ("addressState", "addressState", str),
+    ("addressZipcode", "addressZipcode", str),
+    ("isUndisclosedAddress", "isUndisclosedAddress", bool),
+    ("beds", "beds", float),
+    ("baths", "baths", float),
+    ("area", "area", float),
+    ("latitude", "latLong.latitude", float),
+    ("longitude", "latLong.longitude", float),
+    ("isZillowOwned", "isZillowOwned", bool),
+    ("zestimate", "zestimate", float),
+    ("brokerName", "brokerName", str),
+    ("isFeaturedListing", "isFeaturedListing", bool),
+    ("isShowcaseListing", "isShowcaseListing", bool),
+    ("availabilityDate", "availabilityDate", str),
+    ("hasOpenHouse", "hasOpenHouse", bool),
+    ("openHouseDescription", "openHouseDescription", str),
+    ("openHouseStartDate", "openHouseStartDate", str),
+    ("openHouseEndDate", "openHouseEndDate", str),
+    ("lotAreaString", "lotAreaString", str),
+]
+
+
+def parse_numbers(series):
+    # parse_price() for a whole column: numbers pass through, the first number of each string ("$3,450+", "2 bds") is extracted
+    numbers = pd.to_numeric(series, errors="coerce").astype("float64")
+    strings = numbers.isna() & series.notna()
+    if strings.any():
+        extracted = series[strings].astype(str).str.extract(number_pattern, expand=False).str.replace(",", "", regex=False)
+        numbers[strings] = pd.to_numeric(extracted, errors="coerce")
+    return numbers
+
+
+def parse_dates(series):
+    # availableFrom is either epoch milliseconds or a date string
+    milliseconds = pd.to_numeric(series, errors="coerce")
+    dates = pd.to_datetime(milliseconds, unit="ms", errors="coerce")
+    strings = milliseconds.isna() & series.notna()
+    if strings.any():
+        dates[strings] = pd.to_datetime(series[strings], errors="coerce")
+    return dates
+
+
+# how normalize_frame() stores each column it finds
+normalized_column_types = {
+    "price": "price",
+    "unformattedPrice": "price",
+    "zestimate": "price",
+    "beds": "count",
+    "area": "count",
+    "sqft": "count",
+    "baths": "float",
+    "latitude": "coordinate",
+    "longitude": "coordinate",
+    "zipcode": "category",
+    "unit_zipcode": "category",
+    "addressZipcode": "category",
+    "city": "category",
+    "unit_city": "category",
+    "addressCity": "category",
+    "addressState": "category",
+    "available_from": "date",
+}
+
+
+def normalize_frame(frame):
+    """
+    Converts the scraped columns of frame to compact typed columns, a whole column at a time.
+
+    Prices ("$3,450+", "$3,000/mo", numbers) become float64, beds/area/sqft nullable Int32,
+    baths float32, coordinates float32, cities/zip codes/states categoricals and available_from
+    datetimes. Values that can't be parsed become missing. Columns not in
+    normalized_column_types are left as they are.
+
+    Arguments:
+        frame (pd.DataFrame): rental, sale or unit rows
+    Returns:
+        frame (pd.DataFrame): a copy with the normalized columns
+    """
+    frame = frame.copy(deep=False)
+    for column, column_type in normalized_column_types.items():
+        if column not in frame.columns:
+            continue
+        values = frame[column]
+        if column_type == "price":
+            values = parse_numbers(values)
+        elif column_type == "count":
+            values = parse_numbers(values).round().astype("Int32")
+        elif column_type == "float":
+            values = parse_numbers(values).astype("float32")
+        elif column_type == "coordinate":
+            values = pd.to_numeric(values, errors="coerce").astype("float32")
+        elif column_type == "category":
+            values = values.astype("string").astype("category")
+        elif column_type == "date":
+            values = parse_dates(values)
+        frame[column] = values
+    return frame
+
+
+def make_schema(fields):
+    """
+    Normalizes user supplied fields into schema entries.
+
+    Arguments:
+        fields (dict): column -> path ("hdpData.homeInfo.homeType") or (path, coerce), coerce being
+                       a function like float, int, str, parse_price or to_json, or None to keep the value as is
+    Returns:
+        schema (list): (column, path, coerce) entries, see sale_schema
+    """
+    schema = []
+    for column, field in (fields or {}).items():
+        if isinstance(field, str):
+            field = (field, None)
+        path, coerce = field
+        schema.append((column, path, coerce))
+    return schema
+
+
+def get_path(item, path):
+    # item["a"]["b"] for path "a.b" (a digit indexes a list), None if any part is missing
+    for key in path.split("."):
+        if isinstance(item, dict):
+            item = item.get(key)
+        elif isinstance(item, list) and key.isdigit() and int(key) < len(item):
+            item = item[int(key)]
+        else:
+            return None
+        if item is None:
+            return None
+    return item
+
+
+def project_listing(item, schema):
+    # the row of a search result holding only the columns of schema, values that can't be coerced are None
+    record = {}
+    for column, path, coerce in schema:
+        value = get_path(item, path)
+        if value is not None and coerce is not None:
+            try:
+                value = coerce(value)
+            except (ValueError, TypeError):
+                value = None
+        record[column] = value
+    return record
+
+
+class CrawlMetrics:
+    """
+    Timings and counters of the stages of a crawl, shared by every thread of the run.
+
+    Each stage ("url", "fetch", "browser_fetch", "extract", "flatten", "expand", "write")
+    keeps its number of calls and total seconds, fetch stages also the bytes downloaded,
+    retries and failures. Stages nest, ie. "expand" includes the building pages it fetches
+    and "fetch" the time spent waiting on the rate limiter, which is also kept as "rate_limit".
+    The responses_* counters count the requests by classify_response() outcome.
+    Every measurement is passed to the callbacks as an event dict and logged to the
+    "zillow_scraper" logger at DEBUG level.
+
+    Arguments:
+        callback (callable): called with each event, {"stage": ..., "seconds": ..., ...}
+    """
+
+    stages = ["url", "rate_limit", "fetch", "browser_fetch", "extract", "flatten", "expand", "write"]
+
+    def __init__(self, callback=None):
+        self.lock = threading.Lock()
+        self.callbacks = [callback] if callback is not None else []
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.monotonic()
+            self.timings = {stage: {"calls": 0, "seconds": 0.0, "bytes": 0, "retries": 0, "failures": 0} for stage in self.stages}
+            self.counters = {
+                "cache_hits": 0, "cache_misses": 0, "listings": 0, "rows_written": 0,
+                "responses_ok": 0, "responses_throttled": 0, "responses_blocked": 0, "responses_missing": 0,
+            }
+            self.gauges = {}
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def record(self, stage, seconds, bytes=0, retries=0, failed=False):
+        with self.lock:
+            timing = self.timings.setdefault(stage, {"calls": 0, "seconds": 0.0, "bytes": 0, "retries": 0, "failures": 0})
+            timing["calls"] += 1
+            timing["seconds"] += seconds
+            timing["bytes"] += bytes
+            timing["retries"] += retries
+            timing["failures"] += int(failed)
+
+        if self.callbacks or logger.isEnabledFor(logging.DEBUG):
+            event = {"stage": stage, "seconds": seconds, "bytes": bytes, "retries": retries, "failed": failed}
+            logger.debug("%s took %.3fs (%d bytes, %d retries, failed=%s)", stage, seconds, bytes, retries, failed)
+            for callback in self.callbacks:
+                callback(event)
+
+    @contextmanager
+    def stage(self, stage):
+        # times the block, the yielded dict can be filled with the bytes/retries/failed of the stage
+        fields = {}
+        start_time = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.record(stage, time.perf_counter() - start_time, **fields)
+
+    def increment(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def set_gauge(self, gauge, value):
+        # a value that goes up and down, ie. the current request rate of an AdaptiveRateLimiter
+        with self.lock:
+            self.gauges[gauge] = value
+
+    def summary(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            lookups = self.counters["cache_hits"] + self.counters["cache_misses"]
+            return {
+                "seconds": elapsed,
+                "stages": {stage: dict(timing) for stage, timing in self.timings.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "cache_hit_rate": self.counters["cache_hits"] / lookups if lookups else None,
+                "listings_per_second": self.counters["listings"] / elapsed if elapsed else None,
+            }
+
+    def to_prometheus(self, prefix="zillow_scraper"):
+        # the summary in the prometheus text exposition format
+        summary = self.summary()
+        lines = []
+
+        def metric(name, metric_type, samples):
+            lines.append("# TYPE {}_{} {}".format(prefix, name, metric_type))
+            for labels, value in samples:
+                lines.append("{}_{}{} {}".format(prefix, name, labels, 0 if value is None else value))
+
+        for field, name in [("calls", "stage_calls_total"), ("seconds", "stage_seconds_total"), ("bytes", "stage_bytes_total"), ("retries", "stage_retries_total"), ("failures", "stage_failures_total")]:
+            metric(name, "counter", [('{{stage="{}"}}'.format(stage), timing[field]) for stage, timing in summary["stages"].items()])
+        for counter, value in summary["counters"].items():
+            metric(counter + "_total", "counter", [("", value)])
+        for gauge, value in summary["gauges"].items():
+            metric(gauge, "gauge", [("", value)])
+        metric("cache_hit_ratio", "gauge", [("", summary["cache_hit_rate"])])
+        metric("listings_per_second", "gauge", [("", summary["listings_per_second"])])
+        metric("elapsed_seconds", "gauge", [("", summary["seconds"])])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # replaces path in one go, so a collector reading it never sees half a file
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+
+default_metrics = CrawlMetrics()
+
+
+def get_metrics():
+    # metrics every stage of every crawl in the process is recorded to
+    return default_metrics
+
+
+def timed_stage(stage):
+    # records each call of the decorated function as stage
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with get_metrics().stage(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
 
 # helper functions
+def get_list_results(data):
+    # the listings of a search page live deep inside the __NEXT_DATA__ json
+    return data['props']['pageProps']['searchPageState']['cat1']['searchResults']['listResults']
+
+
+def append_records(frame, records, columns=None):
+    """
+    Materializes a list of row dicts into a single DataFrame and appends it to frame.
+
+    Building the frame once at the end keeps the frame builders linear in the number
+    of listings, instead of copying the whole frame for every row.
+    """
+    new_frame = pd.DataFrame.from_records(records, columns=columns)
+
+    if len(frame.columns) == 0 and len(frame) == 0:
+        return new_frame
+
+    return pd.concat([frame, new_frame], ignore_index=True)
+
+
+def rental_unit_records(item):
+    # one row per unit of a rental search result
+    unit_description = item['statusText']
+    unit_latitude = item['latLong']['latitude']
+    unit_longitude = item['latLong']['longitude']
+    unit_featured = item['isFeaturedListing']
+    unit_address = item['address']
+    unit_address_street = item['addressStreet']
+    unit_city = item['addressCity']
+    unit_zipcode = item['addressZipcode']
+    unit_img = item['imgSrc']
+
+    # TODO - where is sqft? 
+    records = []
+    for unit in item['units']:
+        records.append({
+            "description": unit_description,
+            "latitude": unit_latitude,
+            "price": unit['price'],
+            "beds": unit['beds'],
+            "longitude": unit_longitude,
+            "featured": unit_featured,
+            "address": unit_address,
+            "address_street": unit_address_street,
+            "city": unit_city,
+            "zipcode": unit_zipcode,
+            "img": unit_img
+        })
+
+    return records
+
+
+def rental_detail_record(item):
+    # check if the unit will require extra work, or is good as is....
+    if "area" in item:
+        listing_type = "regular"
+        beds = item['beds']
+        baths = item['baths']
+        area = item['area']
+        unit_number = None
+        price = item['unformattedPrice']
+
+    else:
+        listing_type = "nested"
+        beds = None
+        baths = None
+        area = None
+        unit_number = None
+        price = None
+
+    return {
+        "listing_type": listing_type,
+        "unit_description": item['statusText'],
+        "detailed_url": item["detailUrl"],
+        "latitude": item['latLong']['latitude'],
+        "longitude": item['latLong']['longitude'],
+        "unit_address": item['address'],
+        "unit_address_street": item['addressStreet'],
+        "unit_city": item['addressCity'],
+        "unit_zipcode": item['addressZipcode'],
+        "beds": beds,
+        "baths": baths,
+        "area": area,
+        "price": price,
+        "unit_number": unit_number,
+    }
+
+
 def make_frame_rentals(frame, data_list):
+    records = []
     for i in data_list:
-        for item in i['props']['pageProps']['searchPageState']['cat1']['searchResults']['listResults']:
+        for item in get_list_results(i):
             try:
-                num_units = len(item['units'])
-
-                unit_description = item['statusText']
-                unit_latitude = item['latLong']['latitude']
-                unit_longitude = item['latLong']['longitude']
-                unit_featured = item['i sFeaturedListing']
-                unit_address = item['address']
-                unit_address_street = item['addressStreet']
-                unit_city = item['addressCity']
-                unit_zipcode = item['addressZipcode']
-                unit_img = item['imgSrc']
-
-                # TODO - where is sqft? 
-                for x in range(0, num_units):
-                    unit_price = item['units'][x]['price']
-                    unit_beds = item['units'][x]['beds']
-
-                    unit_dict = {
-                        "description": unit_description,
-                        "latitude": unit_latitude,
-                        "price": unit_price,
-                        "beds": unit_beds,
-                        "longitude": unit_longitude,
-                        "featured": unit_featured,
-                        "address": unit_address,
-                        "address_street": unit_address_street,
-                        "city": unit_city,
-                        "zipcode": unit_zipcode,
-                        "img": unit_img
-                    }
-
-                    frame = frame.append(unit_dict, ignore_index=True)
+                records.extend(rental_unit_records(item))
             except:
                 pass
 
-    return frame
+    return append_records(frame, records, columns=rental_columns)
 
 def make_frame_rentals_detail(frame, data_list):
+    records = []
     for i in data_list:
-        for item in i['props']['pageProps']['searchPageState']['cat1']['searchResults']['listResults']:
+        for item in get_list_results(i):
             try:
-                # check if the unit will require extra work, or is good as is....
-                if "area" in list(item.keys()):
-                    listing_type = "regular"
-                    beds = item['beds']
-                    baths = item['baths']
-                    area = item['area']
-                    unit_number = None
-                    price = item['unformattedPrice']
-
-                else:
-                    listing_type = "nested"
-                    beds = None
-                    baths = None
-                    area = None
-                    unit_number = None
-                    price = None
-
-                unit_description = item['statusText']
-                detailed_url = item["detailUrl"]
-                latitude = item['latLong']['latitude']
-                longitude = item['latLong']['longitude']
-                unit_address = item['address']
-                unit_address_street = item['addressStreet']
-                unit_city = item['addressCity']
-                unit_zipcode = item['addressZipcode']
-
-                unit_dict = {
-                    "listing_type": listing_type,
-                    "unit_description": unit_description,
-                    "detailed_url": detailed_url,
-                    "latitude": latitude,
-                    "longitude": longitude,
-                    "unit_address": unit_address,
-                    "unit_address_street": unit_address_street,
-                    "unit_city": unit_city,
-                    "unit_zipcode": unit_zipcode,
-                    "beds": beds,
-                    "baths": baths,
-                    "area": area,
-                    "price": price,
-                    "unit_number": unit_number,
-                }
-
-                frame = pd.concat([frame, pd.DataFrame([unit_dict])], ignore_index=True)
-                
+                records.append(rental_detail_record(item))
             except:
                 pass
 
-    return frame
+    return append_records(frame, records, columns=rental_detail_columns)
 
 
-def make_frame_sales(frame, data_list):
+def make_frame_sales(frame, data_list, extra_fields=None):
+    # only the sale_schema columns are materialized, extra_fields (see make_schema()) adds more
+    schema = sale_schema + make_schema(extra_fields)
+    records = []
     for i in data_list:
-        for item in i['props']['pageProps']['searchPageState']['cat1']['searchResults']['listResults']:
-            frame = pd.concat([frame, pd.DataFrame([item])], ignore_index=True)
-    return frame
+        for item in get_list_results(i):
+            records.append(project_listing(item, schema))
+    return append_records(frame, records, columns=[column for column, path, coerce in schema])
 
 
 def extract_listing_count(html_content):
@@ -149,9 +517,174 @@ def extract_listing_count(html_content):
     except Exception as e:
         raise TypeError("Could not extract the number of listings")
 
-def zillow_url_constructor(location, category, pg_num, min_price):
+def extract_result_counts(data, html_content=None):
+    """
+    Returns the total number of results of a search and the number of listings per page.
+
+    Both are read from the searchList section of the search page json, the "result-count"
+    text of the html (see extract_listing_count()) is only used when the json doesn't have it.
+
+    Arguments:
+        data (dict): the __NEXT_DATA__ json of a search page
+        html_content (str): the page html, for the fallback
+    Returns:
+        num_listings (int): number of results of the search
+        num_listings_per_page (int): number of results on a page
+    """
+    search_list = data['props']['pageProps']['searchPageState']['cat1'].get('searchList') or {}
+    num_listings = search_list.get('totalResultCount')
+    if num_listings is None:
+        if html_content is None:
+            raise TypeError("Could not extract the number of listings")
+        num_listings = extract_listing_count(html_content)
+    num_listings_per_page = search_list.get('resultsPerPage') or len(get_list_results(data)) or 1
+    return int(num_listings), int(num_listings_per_page)
+
+# zillow's filterState flags for each home type, a flag set to false hides that type
+home_type_filters = {
+    "house": ["sf"],
+    "townhouse": ["tow"],
+    "multi_family": ["mf"],
+    "condo": ["con", "apco"],
+    "apartment": ["apa", "apco"],
+    "manufactured": ["manu"],
+    "land": ["land"],
+}
+
+search_sorts = ["pricea", "priced", "days", "beds", "baths", "size", "globalrelevanceex"]
+
+
+class SearchQuery:
+    """
+    Filters of a zillow search, applied by zillow itself so only matching listings are paged through.
+
+    A query is immutable and hashable, replace() returns a copy with some filters changed (the
+    crawl uses it to set the price window/map tile of each request). To search a handful of zip
+    codes, use them as the locations of the crawl (ie. "new-york-ny-10001").
+
+    Arguments:
+        min_price (int): lowest price
+        max_price (int): highest price, None for no limit
+        min_beds (int), max_beds (int): number of bedrooms
+        min_baths (float): number of bathrooms
+        min_sqft (int), max_sqft (int): living area
+        home_types (list): only these of "house", "townhouse", "multi_family", "condo", "apartment", "manufactured", "land", None for all
+        map_bounds (dict): west/east/south/north coordinates of the area to search
+        sort (str): result order, one of search_sorts, "pricea" (price ascending) by default
+    """
+
+    def __init__(self, min_price=0, max_price=None, min_beds=None, max_beds=None, min_baths=None, min_sqft=None, max_sqft=None, home_types=None, map_bounds=None, sort="pricea"):
+        for name, low, high in [("price", min_price, max_price), ("beds", min_beds, max_beds), ("sqft", min_sqft, max_sqft)]:
+            for value in [low, high]:
+                if value is not None and (not isinstance(value, (int, float)) or value < 0):
+                    raise TypeError("invalid {} filter for SearchQuery(), must be a non negative number".format(name))
+            if low is not None and high is not None and low > high:
+                raise TypeError("invalid {} filter for SearchQuery(), the minimum is above the maximum".format(name))
+        if min_baths is not None and (not isinstance(min_baths, (int, float)) or min_baths < 0):
+            raise TypeError("invalid baths filter for SearchQuery(), must be a non negative number")
+        if home_types is not None:
+            home_types = tuple(sorted(set(home_types)))
+            if not home_types or any(home_type not in home_type_filters for home_type in home_types):
+                raise TypeError("invalid home_types for SearchQuery(), must be some of {}".format(list(home_type_filters)))
+        if map_bounds is not None:
+            if sorted(map_bounds) != ["east", "north", "south", "west"]:
+                raise TypeError("invalid map_bounds for SearchQuery(), must have west/east/south/north coordinates")
+            map_bounds = dict(map_bounds)
+        if sort not in search_sorts:
+            raise TypeError("invalid sort for SearchQuery(), must be one of {}".format(search_sorts))
+
+        self.min_price = min_price or 0
+        self.max_price = max_price
+        self.min_beds = min_beds
+        self.max_beds = max_beds
+        self.min_baths = min_baths
+        self.min_sqft = min_sqft
+        self.max_sqft = max_sqft
+        self.home_types = home_types
+        self.map_bounds = map_bounds
+        self.sort = sort
+
+    def arguments(self):
+        return {
+            "min_price": self.min_price, "max_price": self.max_price, "min_beds": self.min_beds, "max_beds": self.max_beds,
+            "min_baths": self.min_baths, "min_sqft": self.min_sqft, "max_sqft": self.max_sqft,
+            "home_types": self.home_types, "map_bounds": self.map_bounds, "sort": self.sort,
+        }
+
+    def replace(self, **changes):
+        arguments = self.arguments()
+        arguments.update(changes)
+        return SearchQuery(**arguments)
+
+    def key(self):
+        map_bounds = tuple(sorted(self.map_bounds.items())) if self.map_bounds is not None else None
+        return tuple(self.arguments().items())[:-2] + (map_bounds, self.sort)
+
+    def __eq__(self, other):
+        return isinstance(other, SearchQuery) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return "SearchQuery({})".format(", ".join("{}={!r}".format(name, value) for name, value in self.arguments().items() if value is not None))
+
+    def filter_state(self, category):
+        # the filterState of the searchQueryState, category being "rental" or "sale"
+        filter_state = {
+            "price": {"min": self.min_price},
+            "mp": {"min": self.min_price},
+        }
+        if self.max_price is not None:
+            filter_state["price"]["max"] = self.max_price
+            filter_state["mp"]["max"] = self.max_price
+
+        if category == "rental":
+            filter_state["fr"] = {"value": True}
+            for flag in ["fsba", "fsbo", "nc", "cmsn", "auc", "fore"]:
+                filter_state[flag] = {"value": False}
+        filter_state["sort"] = {"value": self.sort}
+
+        for name, low, high in [("beds", self.min_beds, self.max_beds), ("baths", self.min_baths, None), ("sqft", self.min_sqft, self.max_sqft)]:
+            bounds = {key: value for key, value in [("min", low), ("max", high)] if value is not None}
+            if bounds:
+                filter_state[name] = bounds
+
+        if self.home_types is not None:
+            shown = {flag for home_type in self.home_types for flag in home_type_filters[home_type]}
+            for flags in home_type_filters.values():
+                for flag in flags:
+                    if flag not in shown:
+                        filter_state[flag] = {"value": False}
+
+        return filter_state
+
+    def search_query_state(self, category, pg_num=1):
+        search_query_state = {
+            "pagination": {} if pg_num == 1 else {"currentPage": pg_num},
+            "isMapVisible": True,
+            "filterState": self.filter_state(category),
+            "isListVisible": True,
+            "mapZoom": 11,
+        }
+        if self.map_bounds is not None:
+            search_query_state["mapBounds"] = dict(self.map_bounds)
+        return search_query_state
+
+
+@functools.lru_cache(maxsize=4096)
+def encode_search_query_state(query, category, pg_num):
+    # the url encoded json searchQueryState, the pages of a window share a query so most calls are cache hits
+    return urllib.parse.quote(json.dumps(query.search_query_state(category, pg_num), separators=(",", ":")))
+
+
+@timed_stage("url")
+def zillow_url_constructor(location, category, pg_num, min_price=None, max_price=None, map_bounds=None, query=None):
     """
     Returns a url for the dynamic scraper to use.
+
+    min_price, max_price and map_bounds, when given, override those of query (a SearchQuery),
+    so the crawl can walk price windows and map tiles within the user's filters.
     """
 
     # quick conversion
@@ -161,351 +694,1489 @@ def zillow_url_constructor(location, category, pg_num, min_price):
     # validation
     if category not in ["rental", "sale"]:
         raise TypeError("invalid category for url_constructor(), must be either 'rental', or 'sale'")
-    
-    # --- default dictionaries used for setting parameters --- 
-    rental_search_query_state_dict = {
-        "pagination": {},
-        "isMapVisible": True,
-        "filterState": {
-            "price": {
-                "min": min_price,
-            },
-            "mp": {
-                "min": min_price,
-            },
-            "fr": {
-                "value": True
-            },
-            "fsba": {
-                "value": False
-            },
-            "fsbo": {
-                "value": False
-            },
-            "nc": {
-                "value": False
-            },
-            "cmsn": {
-                "value": False
-            },
-            "auc": {
-                "value": False
-            },
-            "fore": {
-                "value": False
-            },
-            "sort": {
-                "value": "pricea"
-            }
-        },
-        "isListVisible": True,
-        "mapZoom": 11,
-    }
-    sale_search_query_state_dict = {
-        "pagination": {},
-        "isMapVisible": True,
-        "filterState": {
-            "price": {
-                "min": min_price,
-            },
-            "sort": {
-                "value": "pricea"
-            },
-            "mp": {
-                "min": min_price,
-            }
-        },
-        "isListVisible": True,
-        "mapZoom": 11,
-    }
 
+    if query is None:
+        query = SearchQuery()
+    changes = {}
+    if min_price is not None:
+        changes["min_price"] = min_price
+    if max_price is not None:
+        changes["max_price"] = max_price
+    if map_bounds is not None:
+        changes["map_bounds"] = map_bounds
+    query = query.replace(**changes)
+
+    search_query_state = encode_search_query_state(query, category, pg_num)
 
     if category == "rental":
         if pg_num == 1:
-            new_url = "https://www.zillow.com/{location}/{category}/?searchQueryState={searchQueryStateDict}".format(
-                    location = location,
-                    category="rentals",
-                    searchQueryStateDict = urllib.parse.quote(str(rental_search_query_state_dict).replace("True", "true").replace("False", "false"))
-                )
+            new_url = "{base_url}/{location}/rentals/?searchQueryState={search_query_state}"
         else:
-            rental_search_query_state_dict["pagination"] = {"currentPage":pg_num}
-
-            new_url = "https://www.zillow.com/{location}/{category}/{pg_num}_p/?searchQueryState={searchQueryStateDict}".format(
-                location = location,
-                category="rentals",
-                searchQueryStateDict = urllib.parse.quote(str(rental_search_query_state_dict).replace("True", "true").replace("False", "false")),
-                pg_num = pg_num
-            )
-
+            new_url = "{base_url}/{location}/rentals/{pg_num}_p/?searchQueryState={search_query_state}"
     else:
         if pg_num == 1:
-            new_url = "https://www.zillow.com/{location}/?searchQueryState={searchQueryStateDict}".format(
-                    location = location,
-                    searchQueryStateDict = urllib.parse.quote(str(sale_search_query_state_dict).replace("True", "true").replace("False", "false"))
-                )
+            new_url = "{base_url}/{location}/?searchQueryState={search_query_state}"
         else:
-            sale_search_query_state_dict["pagination"] = {"currentPage":pg_num}
-
-            new_url = "https://www.zillow.com/{location}/{pg_num}_p/?searchQueryState={searchQueryStateDict}".format(
-                    location = location,
-                    searchQueryStateDict = urllib.parse.quote(str(sale_search_query_state_dict).replace("True", "true").replace("False", "false")),
-                    pg_num = pg_num
-                )
-            
-    return new_url
-    
-def make_request_with_backoff(url, headers, max_retries=5, base_delay=1):
-    for retry in range(max_retries + 1):
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response
-        
-        print(f"Request failed with status code {response.status_code}. Retrying in {base_delay * (2 ** retry)} seconds...")
-        time.sleep(base_delay * (2 ** retry))
-    
-    print("Max retries reached. Request failed.")
-    return None
+            new_url = "{base_url}/{location}/{pg_num}_p/?searchQueryState={search_query_state}"
 
-def extract_zillow_page_json(request_obj):
+    return new_url.format(base_url=base_url, location=location, pg_num=pg_num, search_query_state=search_query_state)
 
-    # find and extract the JSON of the listings from a zillow page
-    html_content = request_obj.text
-    soup = BeautifulSoup(html_content, 'html.parser')
 
-    # Locate the <script> tag with the specified id
-    script_tag = soup.find('script', {'id': '__NEXT_DATA__'})
+class RateLimiter:
+    """
+    Token bucket rate limiter shared by every request the scraper makes.
 
-    data = None
-    # Extract the JSON content (if the tag is found)
-    if script_tag:
-        json_content = script_tag.string
-        # Now, you can parse the json_content using json.loads
-        data = json.loads(json_content)
-    
-    return data
+    Each request takes a token, tokens refill at requests_per_second and up to burst
+    of them can be saved up. A single instance can be shared between threads (and the
+    requests/selenium fetch paths), so concurrent workers draw from one budget.
 
-def find_new_minimum(data, past_minimums):
-    # get the new minimum price for the next iteration of the dynamic scraper
+    Arguments:
+        requests_per_second (float): sustained request rate, None disables limiting
+        burst (int): number of requests that can be made back to back after being idle
+        per_host (bool): keep a separate budget for each host instead of one global one
+    """
 
-    listing_json = data['props']['pageProps']['searchPageState']['cat1']['searchResults']['listResults']
-    attempt_num = 1
-    # if we aren't able to extract it from the last one, we move backwards until we can...
+    def __init__(self, requests_per_second, burst=1, per_host=False):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.per_host = per_host
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    @classmethod
+    def from_interval(cls, seconds, **kwargs):
+        # one request every `seconds` seconds, the same budget as sleeping between requests
+        if not seconds or seconds <= 0:
+            return cls(None, **kwargs)
+        return cls(1 / seconds, **kwargs)
+
+    def get_bucket(self, url):
+        host = urllib.parse.urlsplit(url).netloc if (self.per_host and url) else None
+        if host not in self.buckets:
+            # "next" is the theoretical arrival time of the next request once the burst is used up
+            self.buckets[host] = {"next": 0.0, "paused_until": 0.0}
+        return self.buckets[host]
+
+    def acquire(self, url=None):
+        """
+        Blocks until a request to url is allowed, returns the number of seconds waited.
+        """
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.get_bucket(url)
+
+            if not self.requests_per_second:
+                request_time = max(now, bucket["paused_until"])
+            else:
+                interval = 1 / self.requests_per_second
+                request_time = max(now, bucket["next"] - (self.burst - 1) * interval, bucket["paused_until"])
+                bucket["next"] = max(bucket["next"], request_time) + interval
+
+        # wait outside of the lock so other threads can reserve their own slots
+        wait = request_time - now
+        if wait > 0:
+            time.sleep(wait)
+        get_metrics().record("rate_limit", max(wait, 0))
+        return max(wait, 0)
+
+    def pause(self, seconds, url=None):
+        """
+        Holds back every request sharing url's budget for the next `seconds` seconds.
+        """
+        with self.lock:
+            bucket = self.get_bucket(url)
+            bucket["paused_until"] = max(bucket["paused_until"], time.monotonic() + seconds)
+
+    def feedback(self, outcome, url=None, retry_after=None):
+        """
+        Tells the limiter how a request to url went, see classify_response().
+
+        A fixed rate ignores it and returns None, callers then back off on their own.
+        """
+        return None
 
-    continue_run = True
-    while continue_run:
 
-        # if it is a non-nested listing, try extracting the price
-        if "units" not in list(listing_json[len(listing_json)-attempt_num].keys()):
-            try:
-                return float(listing_json[len(listing_json)-attempt_num]['unformattedPrice'])
-            except:
-                pass
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    RateLimiter that finds the fastest rate zillow tolerates, AIMD style.
 
-        # if it is a nested listing, go through more complex logic to extract the price...
-        else:
-            if len(listing_json[len(listing_json)-attempt_num]['units']) == 1:
-                # if there is only one unit, it is simple to extract the price...
-                price = listing_json[len(listing_json)-attempt_num]['units'][0]['price']
-                # convert to numeric
-                price = float(price.replace("$", "").replace(",", "").replace("+", ""))
-                return price
-            elif len(listing_json[len(listing_json)-attempt_num]['units']) > 1:
-                # if there are multiple, take the bottom one that isn't less than past minimums (that way we don't end up in a loop)
-                unit_prices = [unit['price'] for unit in listing_json[len(listing_json)-attempt_num]['units']]
-                
-                # convert price strings to numeric
-                unit_prices = [float(unit_price.replace("$", "").replace(",", "").replace("+", "")) for unit_price in unit_prices]
+    After increase_after "ok" responses in a row the rate goes up by increase requests per
+    second (up to max_rate). A "throttled" response (429, 5xx, no response) or a page
+    "missing" its json multiplies the rate by decrease. A "blocked" one (403 or a captcha
+    page) drops it to min_rate and pauses every request for block_pause seconds, doubling
+    with each block in a row up to max_block_pause, after which requests probe the site
+    again at min_rate.
 
-                # remove all prices that are lower than previous minimums
-                unit_prices = [unit_price for unit_price in unit_prices if unit_price < max(past_minimums)]
+    Attributes:
+        sustainable_rate (float): highest rate actually sent through increase_after ok responses in a row that is below every rate throttled at since, None until one did
+        outcomes (dict): number of responses fed back per outcome
 
-                # if there are still prices after filtering, get the lowest one
-                if unit_prices:
-                    return min(unit_prices)
+    Arguments:
+        requests_per_second (float): rate to start at
+        min_rate (float): lowest rate, the rate blocked requests probe at
+        max_rate (float): highest rate
+        increase (float): requests per second added after increase_after ok responses
+        increase_after (int): ok responses in a row before the rate goes up
+        decrease (float): factor the rate is multiplied by on a throttled/missing response
+        block_pause (int): seconds everything waits after the first block
+        max_block_pause (int): longest wait after blocks in a row
+        burst (int), per_host (bool): see RateLimiter
+    """
 
-                # if there are not, move on                    
-                else:
-                    pass
-            else:
-                pass
-                # if there are no units there is a problem...move back one more
+    def __init__(self, requests_per_second=0.5, min_rate=1 / 120, max_rate=5, increase=0.05, increase_after=10, decrease=0.5, block_pause=60, max_block_pause=30 * 60, burst=1, per_host=False):
+        super().__init__(requests_per_second or max_rate, burst=burst, per_host=per_host)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.increase_after = increase_after
+        self.decrease = decrease
+        self.block_pause = block_pause
+        self.max_block_pause = max_block_pause
+        self.ok_streak = 0
+        self.blocks_in_a_row = 0
+        self.sustainable_rate = None
+        # rates that got through increase_after ok responses in a row, less those at or above a rate throttled at later
+        self.proven_rates = set()
+        self.streak_started = time.monotonic()
+        self.outcomes = {"ok": 0, "throttled": 0, "blocked": 0, "missing": 0}
+        self.started = time.monotonic()
+        self.set_rate(self.requests_per_second)
+
+    def set_rate(self, requests_per_second):
+        self.requests_per_second = min(max(requests_per_second, self.min_rate), self.max_rate)
+        get_metrics().set_gauge("requests_per_second", self.requests_per_second)
+
+    def cut_rate(self, requests_per_second):
+        # a proven rate at or above the one that just failed wasn't sustainable after all, fall back on the best one below it
+        failed_rate = self.requests_per_second
+        self.proven_rates = set(rate for rate in self.proven_rates if rate < failed_rate)
+        self.sustainable_rate = max(self.proven_rates) if self.proven_rates else None
+        if self.sustainable_rate is not None:
+            get_metrics().set_gauge("sustainable_requests_per_second", self.sustainable_rate)
+        self.ok_streak = 0
+        self.streak_started = time.monotonic()
+        self.set_rate(requests_per_second)
+
+    def feedback(self, outcome, url=None, retry_after=None):
+        """
+        Adjusts the rate to the outcome of a request, returns the seconds every request was paused for.
+        """
+        pause = 0
+        with self.lock:
+            if outcome in self.outcomes:
+                self.outcomes[outcome] += 1
+
+            if outcome == "ok":
+                self.blocks_in_a_row = 0
+                self.ok_streak += 1
+                if self.ok_streak >= self.increase_after:
+                    # the workers may not keep up with the allowed rate, only count the rate the streak actually ran at
+                    now = time.monotonic()
+                    streak_rate = self.ok_streak / max(now - self.streak_started, 1e-9)
+                    self.ok_streak = 0
+                    self.streak_started = now
+                    self.proven_rates.add(min(self.requests_per_second, streak_rate))
+                    self.sustainable_rate = max(self.proven_rates)
+                    get_metrics().set_gauge("sustainable_requests_per_second", self.sustainable_rate)
+                    self.set_rate(self.requests_per_second + self.increase)
+            elif outcome in ["throttled", "missing"]:
+                self.cut_rate(self.requests_per_second * self.decrease)
+                pause = retry_after or 0
+            elif outcome == "blocked":
+                self.cut_rate(self.min_rate)
+                pause = retry_after or min(self.block_pause * 2 ** self.blocks_in_a_row, self.max_block_pause)
+                self.blocks_in_a_row += 1
+
+        if pause:
+            logger.info("%s by %s, pausing requests for %.0fs, rate now %.3f/s", outcome, url, pause, self.requests_per_second)
+            self.pause(pause, url)
+        return pause
+
+    def summary(self):
+        # the current and sustainable rate, the rate of ok responses actually achieved so far and the outcome counts
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                "requests_per_second": self.requests_per_second,
+                "sustainable_rate": self.sustainable_rate,
+                "achieved_rate": self.outcomes["ok"] / elapsed if elapsed else None,
+                "outcomes": dict(self.outcomes),
+            }
 
-        # if we weren't able to extract the minimum price from it, move on to the next one.    
-        attempt_num += 1
-    
-def zillow_scraper(city, property_type, time_between_scrapes, min_price, testing):
-    """
 
-    Collects all data available for a given city (either rental or sales). 
+def make_session(pool_size=10):
+    """
+    Returns a requests.Session that keeps connections to zillow alive between requests.
 
     Arguments:
-        city (str): city name
-        property_type (str): either "sale" or "rent"
-        time_between_scrapes (int): number of seconds to wait before making consecutive requests
-        min_price (int): the minimum price to start filtering on, useful to continue scraping if it is interrupted.
-        testing (bool): if true, will return only the first page
-    Returns:
-        data_dict (dict): collection of extracted data
+        pool_size (int): number of connections kept open per host, should be at least the number of concurrent workers
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(headers)
+    return session
+
+
+default_session = None
+defaults_lock = threading.Lock()
+stats_lock = threading.Lock()
+
+def get_session():
+    # the module level session used when a caller doesn't provide its own
+    global default_session
+    with defaults_lock:
+        if default_session is None:
+            default_session = make_session()
+        return default_session
+
+
+def get_retry_after(response):
+    # number of seconds the server asked us to wait, None if it didn't say
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+        return max(retry_time.timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
 
+
+def record_request_stats(stats, attempts, latency, failed):
+    if stats is None:
+        return
+    with stats_lock:
+        stats["requests"] = stats.get("requests", 0) + 1
+        stats["attempts"] = stats.get("attempts", 0) + attempts
+        stats["retries"] = stats.get("retries", 0) + attempts - 1
+        stats["failures"] = stats.get("failures", 0) + int(failed)
+        stats["latency"] = stats.get("latency", 0) + latency
+
+
+def canonicalize_url(url):
     """
-    data_list = []
+    Returns a normalized form of url so equivalent search/detail urls share a cache entry.
 
-    # Validation
-    if property_type not in ["sale", "rent"]:
-        raise TypeError("property_type:", property_type,
-                        "is not valid, select either 'sale' or 'rent'")
-                        
-    
-    # --- get the total number of listings for the run --- 
+    The host is lowercased, query parameters are sorted and a json searchQueryState is
+    re-serialized with sorted keys.
+    """
+    parts = urllib.parse.urlsplit(url)
+    query = []
+    for key, value in sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)):
+        if key == "searchQueryState":
+            try:
+                value = json.dumps(json.loads(value), sort_keys=True, separators=(",", ":"))
+            except ValueError:
+                pass
+        query.append((key, value))
 
-    try:
-        # use selenium to extract the html from the site
-        driver = webdriver.Chrome()
+    path = parts.path or "/"
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urllib.parse.urlencode(query), ""))
 
-        url = 'https://www.zillow.com/homes/for_{property_type}/'.format(
-            property_type=property_type) + city
 
-        # open the page
-        driver.get(url)
+class ResponseCache:
+    """
+    On-disk cache of fetched pages, stored compressed in a SQLite database.
 
-        html_content = driver.page_source
-        driver.quit()
+    Entries are keyed on the hash of the canonicalized url, expire after ttl seconds and
+    the least recently used ones are evicted once the cache grows past max_bytes. The page
+    bodies live in their own table and the total size is kept as a running count, so
+    neither expiry nor eviction has to read past the stored pages.
 
-        num_listings = extract_listing_count(html_content)
+    Arguments:
+        path (str): location of the SQLite database file
+        ttl (int): seconds an entry is served for, None keeps entries until evicted
+        max_bytes (int): maximum total size of the compressed entries
+    """
 
-        # --- calculate the number of listings per page... ---
-        soup = BeautifulSoup(html_content, 'html.parser')
+    def __init__(self, path="zillow_cache.sqlite", ttl=24 * 60 * 60, max_bytes=2 * 1024 ** 3):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, url TEXT, size INTEGER, created REAL, accessed REAL)"
+            )
+            self.connection.execute("CREATE TABLE IF NOT EXISTS bodies (key TEXT PRIMARY KEY, body BLOB)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries (created)")
+
+            # caches written before the bodies were split out keep their pages
+            if self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'responses'").fetchone():
+                self.connection.execute("INSERT OR REPLACE INTO entries SELECT key, url, size, created, accessed FROM responses")
+                self.connection.execute("INSERT OR REPLACE INTO bodies SELECT key, body FROM responses")
+                self.connection.execute("DROP TABLE responses")
+
+        self.total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def make_key(self, url):
+        return hashlib.sha256(canonicalize_url(url).encode("utf-8")).hexdigest()
+
+    def remove_keys(self, keys):
+        # keys is a list of (key, size), must be called holding the lock and inside a transaction
+        self.connection.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, size in keys])
+        self.connection.executemany("DELETE FROM bodies WHERE key = ?", [(key,) for key, size in keys])
+        self.total_size -= sum(size for key, size in keys)
+
+    def get(self, url):
+        # returns the cached body as bytes, None on a miss or an expired entry
+        key = self.make_key(url)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT size, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row[1] > self.ttl:
+                with self.connection:
+                    self.remove_keys([(key, row[0])])
+                return None
+            body = self.connection.execute("SELECT body FROM bodies WHERE key = ?", (key,)).fetchone()
+            if body is None:
+                return None
+            with self.connection:
+                self.connection.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return zlib.decompress(body[0])
+
+    def set(self, url, body):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        compressed = zlib.compress(body)
+        key = self.make_key(url)
+        now = time.time()
+        with self.lock, self.connection:
+            previous = self.connection.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, url, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, url, len(compressed), now, now),
+            )
+            self.connection.execute("INSERT OR REPLACE INTO bodies (key, body) VALUES (?, ?)", (key, compressed))
+            self.total_size += len(compressed) - (previous[0] if previous else 0)
+            self.evict()
+
+    def evict(self):
+        # drop expired entries (an index range, usually empty), then the least recently used ones until we're under max_bytes
+        if self.ttl is not None:
+            expired = self.connection.execute("SELECT key, size FROM entries WHERE created < ?", (time.time() - self.ttl,)).fetchall()
+            if expired:
+                self.remove_keys(expired)
+        if self.max_bytes is None or self.total_size <= self.max_bytes:
+            return
+        # another process may share the file, recount before evicting anything
+        self.total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        stale_keys = []
+        total_size = self.total_size
+        for key, size in self.connection.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            if total_size <= self.max_bytes:
+                break
+            stale_keys.append((key, size))
+            total_size -= size
+        self.remove_keys(stale_keys)
+
+    def delete(self, url):
+        key = self.make_key(url)
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.remove_keys([(key, row[0])])
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM entries")
+            self.connection.execute("DELETE FROM bodies")
+            self.total_size = 0
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def make_cached_response(url, body):
+    # wraps a cached body in a response object so callers can't tell it apart from a fetched one
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response._content = body
+    response.encoding = "utf-8"
+    response.from_cache = True
+    response.attempts = 0
+    response.latency = 0
+    return response
+
+
+def is_block_page(url, content):
+    # a captcha/access denied page, real pages carry their __NEXT_DATA__ json
+    if isinstance(content, str):
+        content = content.encode("utf-8", errors="replace")
+    if "captcha" in (url or "").lower():
+        return True
+    return b"__NEXT_DATA__" not in content and any(marker in content for marker in block_markers)
+
+
+def classify_response(response):
+    """
+    Sorts the outcome of a request into what an AdaptiveRateLimiter reacts to.
 
-        # Locate the <script> tag with the specified id
-        script_tag = soup.find('script', {'id': '__NEXT_DATA__'})
-
-        # Extract the JSON content (if the tag is found)
-        if script_tag:
-            json_content = script_tag.string
-            # Now, you can parse the json_content using json.loads
-            data = json.loads(json_content)
-            data_list.append(data)
-
-            num_listings_per_page = len(
-                data['props']['pageProps']['searchPageState']['cat1']['searchResults']['listResults'])
-
-            # there is only 20 pages at max....so we need to calculate the max number of results that we are looking for in a query
-            max_results = num_listings_per_page*20
-
-            print("Total Listings:", num_listings)
-        
-        # if in testing mode, return the first bit
-        if testing:
-            data_dict = {
-                "data_list":data_list,
-                "min_price":min_price,
-                "num_listings":num_listings
-            }
-            return data_dict
+    Returns:
+        outcome (str): "ok", "throttled" (429, 5xx or no response at all), "blocked" (403 or a captcha page) or "failed" (any other status, ie. a 404)
+    """
+    if response is None or response.status_code in retry_status_codes:
+        return "throttled"
+    if response.status_code in block_status_codes:
+        return "blocked"
+    if response.status_code != 200:
+        return "failed"
+    if is_block_page(response.url, response.content):
+        return "blocked"
+    return "ok"
+
+
+def make_request_with_backoff(url, headers, max_retries=5, base_delay=1, rate_limiter=None, session=None, timeout=30, stats=None, cache=None):
+    """
+    Requests url, retrying throttled (429), server error (5xx) and connection failures with jittered exponential backoff.
 
-    except Exception as e:
-        raise TypeError(
-            "Error with getting the total number of listings")
-    
+    Other non-200 responses (404 etc.) fail straight away. A Retry-After header from the
+    server takes precedence over the backoff delay. Every response is classified (see
+    classify_response()) and fed back to rate_limiter; an AdaptiveRateLimiter then does the
+    backing off itself, for every worker, and also waits out blocks (403s and captcha pages)
+    instead of failing on them. Captcha pages are never cached.
 
-    # --- Run Dynamic Scraper --- 
-    # The idea here is to take chunks at a time...we set a minimum to max and sort in ascending....
-    # take the price of the last one, and set that to be the next minimum, collect and run again until all are collected....
-    # We know when to stop, when the total number of results are less than the max results (thats a sign we've hit the top)
-        # For this case, we'll also need to calculate the number of pages to collect so we don't over-do it. (originally removed from zillow_scraper.ipynb)
+    Arguments:
+        url (str): url to request
+        headers (dict): request headers
+        max_retries (int): number of retries after the first attempt
+        base_delay (int): backoff delay of the first retry in seconds, doubled on every retry
+        rate_limiter (RateLimiter): limiter every attempt is made through
+        session (requests.Session): session to make the request with, defaults to a shared pooled session
+        timeout (int): seconds to wait for the server before giving up on an attempt
+        stats (dict): if given, request/attempt/retry/failure counts and total latency are added to it
+        cache (ResponseCache): successful responses are served from and saved to this cache
+    Returns:
+        response (requests.Response): the response with `attempts` and `latency` (seconds, all attempts) set, or None if it failed
+    """
+    if cache is not None:
+        body = cache.get(url)
+        if body is not None:
+            get_metrics().increment("cache_hits")
+            return make_cached_response(url, body)
+        get_metrics().increment("cache_misses")
 
-    # variables for the loop 
-    
-    run_dynamic_scraper = True
-    min_price = min_price
-    target_pages = 20
-    past_minimums = [0]
+    if session is None:
+        session = get_session()
+
+    start_time = time.monotonic()
+    for retry in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire(url)
 
-    # Continue to run the scraper until the maximum number of listings is hit.
-    while run_dynamic_scraper:
         try:
-            pg_num = 1
-            # collect the first page, find out how many more pages to collect....
-            #  construct the url given the minimum price, location, etc.. 
-            url = zillow_url_constructor(location=city, category=property_type, pg_num=pg_num, min_price=min_price)
+            response = session.get(url, headers=headers, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            response = None
+            error = e
+        else:
+            error = f"status code {response.status_code}"
+
+        outcome = classify_response(response)
+        if outcome != "failed":
+            get_metrics().increment("responses_" + outcome)
+        retry_after = get_retry_after(response) if response is not None else None
+        # an AdaptiveRateLimiter adjusts its rate and pauses every worker itself, a fixed rate returns None
+        paused = rate_limiter.feedback(outcome, url, retry_after=retry_after) if rate_limiter is not None else None
+
+        if outcome == "ok":
+            if cache is not None:
+                cache.set(url, response.content)
+            response.from_cache = False
+            response.attempts = retry + 1
+            response.latency = time.monotonic() - start_time
+            record_request_stats(stats, response.attempts, response.latency, failed=False)
+            get_metrics().record("fetch", response.latency, bytes=len(response.content), retries=retry)
+            return response
 
-            # make request with retries/backoff system
-            r = make_request_with_backoff(url = url, headers=headers, base_delay=time_between_scrapes)
+        if outcome == "blocked" and response.status_code == 200:
+            error = "a captcha page"
+        # blocks are only waited out by an adaptive limiter, which pauses and then probes at its lowest rate
+        if outcome == "failed" or (outcome == "blocked" and paused is None):
+            print(f"Request failed with {error}, not retrying.")
+            break
 
-            # if it is empty, raise error and end the script
-            if not r:
-                raise TypeError("make_request_with_backoff() failed, aborting scraping run.")
+        if retry == max_retries:
+            print("Max retries reached. Request failed.")
+            break
 
-            # if it is not empty, collect the data of interest. 
-            data = extract_zillow_page_json(r)
+        if paused is not None:
+            print(f"Request failed with {error}. Retrying at {rate_limiter.requests_per_second:.3f} requests/s...")
+            continue
 
-            if data:
-                # if there is data, record it
-                data_list.append(data)
+        delay = random.uniform(0.5, 1) * base_delay * (2 ** retry)
+        if retry_after is not None:
+            delay = retry_after
 
-                # on the first request...check to see if it is the last sequence to run (are there 20 pages of data?)
-                if pg_num == 1: # ERROR IS HERE....
-                    num_listings = extract_listing_count(r.text)
-                    num_listings_per_page = len(data['props']['pageProps']['searchPageState']['cat1']['searchResults']['listResults'])
-                    pages_to_collect = math.ceil(num_listings/num_listings_per_page)
-                    if pages_to_collect < 20:
-                        run_dynamic_scraper = False
-                        target_pages = pages_to_collect
-            else:
-                # if there is no data, need to debug and figure out why it wasn't able to extract...
-                print("=== Page HTML ====")
-                print(r.text)
-                print("=== End === ")
-                raise TypeError("extract_zillow_page_json() failed, aborting scraping run.")
+        print(f"Request failed with {error}. Retrying in {delay:.1f} seconds...")
+        if rate_limiter is not None:
+            # back off through the shared limiter so every worker slows down, not just this one
+            rate_limiter.pause(delay, url)
+        else:
+            time.sleep(delay)
 
+    record_request_stats(stats, retry + 1, time.monotonic() - start_time, failed=True)
+    get_metrics().record("fetch", time.monotonic() - start_time, retries=retry, failed=True)
+    return None
 
-            # collect all remaining pages of data
-            for pg_num in range(2, target_pages+1):
-                #  construct the url given the minimum price, location, etc.. 
-                url = zillow_url_constructor(location=city, category=property_type, pg_num=pg_num, min_price=min_price)
+def make_chrome_driver(headless=True):
+    # default factory used by DriverPool
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+    options.add_argument("--user-agent=" + headers["User-Agent"])
+    return webdriver.Chrome(options=options)
 
-                # make request with retries/backoff system
-                r = make_request_with_backoff(url = url, headers=headers, base_delay=time_between_scrapes)
 
-                # if it is empty, raise error and end the script
-                if not r:
-                    raise TypeError("make_request_with_backoff() failed, aborting scraping run.")
+class DriverPool:
+    """
+    Keeps selenium drivers alive between page loads instead of starting a browser per page.
 
-                # if it is not empty, collect the data of interest. 
-                data = extract_zillow_page_json(r)
+    Drivers are started lazily, handed out one caller at a time, recycled after
+    max_pages_per_driver pages and thrown away if a page load raises (a crashed or
+    wedged browser is never reused).
 
-                if data:
-                    # if there is data, record it
-                    data_list.append(data)
-                else:
-                    # if there is no data, need to debug and figure out why it wasn't able to extract...
-                    print("=== Page HTML ====")
-                    print(r.text)
-                    print("=== End === ")
-                    raise TypeError("extract_zillow_page_json() failed, aborting scraping run.")
+    Arguments:
+        driver_factory (callable): returns a new driver, defaults to a headless chrome
+        max_drivers (int): maximum number of drivers open at once
+        max_pages_per_driver (int): number of pages a driver loads before being restarted
+    """
 
-                # wait between each request to avoid being blocked
-                time.sleep(time_between_scrapes)
+    def __init__(self, driver_factory=make_chrome_driver, max_drivers=1, max_pages_per_driver=50):
+        self.driver_factory = driver_factory
+        self.max_pages_per_driver = max_pages_per_driver
+        self.slots = threading.BoundedSemaphore(max_drivers)
+        self.lock = threading.Lock()
+        self.idle = []
 
-            # after all the data has been collected...we need to find out the new minimum_price for the next round...
-            # use "data" since it is the from the last round.
-            past_minimums.append(min_price) # save the old minimum price
-            min_price = find_new_minimum(data, past_minimums = past_minimums) # set the new minimum price
+    @contextmanager
+    def driver(self):
+        self.slots.acquire()
+        try:
+            with self.lock:
+                entry = self.idle.pop() if self.idle else None
+            if entry is None:
+                entry = {"driver": self.driver_factory(), "pages": 0}
+
+            try:
+                yield entry["driver"]
+            except Exception:
+                self.quit_driver(entry["driver"])
+                raise
+
+            entry["pages"] += 1
+            if entry["pages"] >= self.max_pages_per_driver:
+                self.quit_driver(entry["driver"])
+            else:
+                with self.lock:
+                    self.idle.append(entry)
+        finally:
+            self.slots.release()
+
+    def get_page_source(self, url):
+        with self.driver() as driver:
+            driver.get(url)
+            return driver.page_source
+
+    def quit_driver(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for entry in idle:
+            self.quit_driver(entry["driver"])
+
+
+default_driver_pool = None
+
+def get_driver_pool():
+    # the module level pool used when a caller doesn't provide its own
+    global default_driver_pool
+    with defaults_lock:
+        if default_driver_pool is None:
+            default_driver_pool = DriverPool()
+            atexit.register(default_driver_pool.close)
+        return default_driver_pool
+
+
+def fetch_page_source(url, driver_pool=None, rate_limiter=None, cache=None):
+    # load url in a pooled browser and return the rendered html
+    if cache is not None:
+        body = cache.get(url)
+        if body is not None:
+            get_metrics().increment("cache_hits")
+            return body.decode("utf-8")
+        get_metrics().increment("cache_misses")
+
+    if driver_pool is None:
+        driver_pool = get_driver_pool()
+    if rate_limiter is not None:
+        rate_limiter.acquire(url)
+    with get_metrics().stage("browser_fetch") as fields:
+        try:
+            html_content = driver_pool.get_page_source(url)
+        except Exception:
+            fields["failed"] = True
+            raise
+        fields["bytes"] = len(html_content.encode("utf-8"))
+
+    if cache is not None:
+        cache.set(url, html_content)
+    return html_content
+
+
+@timed_stage("extract")
+def extract_next_data(html_content):
+    """
+    Extracts and parses the __NEXT_DATA__ json embedded in a zillow page.
+
+    The script tag is located by slicing the raw page directly, which avoids building a
+    BeautifulSoup tree of the whole (multi-megabyte) document. If that fails, it falls
+    back to parsing the page with BeautifulSoup.
+
+    Arguments:
+        html_content (str or bytes): the page html
+    Returns:
+        data (dict): the parsed json, or None if the page does not contain it
+    """
+    try:
+        data = slice_next_data(html_content)
+        if data is not None:
+            return data
+    except ValueError:
+        pass
+
+    if isinstance(html_content, bytes):
+        html_content = html_content.decode("utf-8", errors="replace")
+
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    # Locate the <script> tag with the specified id
+    script_tag = soup.find('script', {'id': '__NEXT_DATA__'})
+
+    data = None
+    # Extract the JSON content (if the tag is found)
+    if script_tag and script_tag.string:
+        data = json.loads(script_tag.string)
+
+    return data
+
+
+def slice_next_data(html_content):
+    # fast path for extract_next_data(), works on both str and bytes
+    if isinstance(html_content, bytes):
+        marker, tag_open, tag_end, tag_close = b'__NEXT_DATA__', b'<script', b'>', b'</script>'
+    else:
+        marker, tag_open, tag_end, tag_close = '__NEXT_DATA__', '<script', '>', '</script>'
+
+    marker_index = html_content.find(marker)
+    while marker_index != -1:
+        # make sure the marker is inside the attributes of a <script> tag
+        tag_start = html_content.rfind(tag_open, 0, marker_index)
+        content_start = html_content.find(tag_end, marker_index)
+        if tag_start != -1 and content_start != -1 and html_content.rfind(tag_end, tag_start, marker_index) == -1:
+            content_end = html_content.find(tag_close, content_start)
+            if content_end == -1:
+                return None
+            return json.loads(html_content[content_start + 1:content_end])
+
+        marker_index = html_content.find(marker, marker_index + 1)
+
+    return None
+
+
+def fetch_next_data(url, rate_limiter=None, driver_pool=None, is_complete=None, fetch_tiers=None, max_retries=2, base_delay=1, cache=None):
+    """
+    Gets the __NEXT_DATA__ json of a page, using the cheapest fetch that works.
+
+    A plain http request is tried first, the page is only loaded in a browser when the
+    response is missing the payload (or is_complete rejects it). A request that failed
+    (404, 403, retries used up) isn't retried in the browser, the page is gone or the
+    site is blocking, and loading it again would only cost another request.
+
+    Arguments:
+        url (str): page to fetch
+        rate_limiter (RateLimiter): limiter both tiers go through
+        driver_pool (DriverPool): browsers used for the fallback
+        is_complete (callable): given the parsed json, returns False if the page needs the browser after all
+        fetch_tiers (dict): if given, url -> "cache", "http" or "browser" is recorded in it
+        max_retries (int): retries of the http request before falling back
+        base_delay (int): backoff delay of the http retries
+        cache (ResponseCache): cache both tiers read from and write to
+    Returns:
+        data (dict): the parsed json, None if the request failed or neither tier found it
+    """
+    r = make_request_with_backoff(url, headers=headers, max_retries=max_retries, base_delay=base_delay, rate_limiter=rate_limiter, cache=cache)
+    if r is None:
+        return None
+
+    data = extract_zillow_page_json(r)
+    if data is not None and (is_complete is None or is_complete(data)):
+        if fetch_tiers is not None:
+            fetch_tiers[url] = "cache" if r.from_cache else "http"
+        return data
+
+    # the cache may hold the incomplete http page, so skip it here and replace it with the rendered one
+    html_content = fetch_page_source(url, driver_pool=driver_pool, rate_limiter=rate_limiter)
+    data = extract_next_data(html_content)
+    if data is None:
+        outcome = "blocked" if is_block_page(url, html_content) else "missing"
+        get_metrics().increment("responses_" + outcome)
+        if rate_limiter is not None:
+            rate_limiter.feedback(outcome, url)
+    elif cache is not None:
+        cache.set(url, html_content)
+    if fetch_tiers is not None:
+        fetch_tiers[url] = "browser"
+    return data
+
+
+def extract_zillow_page_json(request_obj):
+
+    # find and extract the JSON of the listings from a zillow page
+    return extract_next_data(request_obj.content)
+
+def fetch_search_page(url, time_between_scrapes, rate_limiter=None, cache=None, max_attempts=3):
+    # make request with retries/backoff system
+    for attempt in range(max_attempts):
+        r = make_request_with_backoff(url = url, headers=headers, base_delay=time_between_scrapes, rate_limiter=rate_limiter, cache=cache)
+
+        # if it is empty, raise error and end the script
+        if not r:
+            raise TypeError("make_request_with_backoff() failed, aborting scraping run.")
+
+        # if it is not empty, collect the data of interest. 
+        data = extract_zillow_page_json(r)
+        if data:
+            return r, data
+
+        # a page without the json is usually a soft block, slow down and fetch it again rather than keeping it
+        outcome = "blocked" if is_block_page(r.url, r.content) else "missing"
+        get_metrics().increment("responses_" + outcome)
+        if cache is not None:
+            cache.delete(url)
+        if rate_limiter is not None:
+            rate_limiter.feedback(outcome, url)
+        print("No listings json in the page ({}, {} bytes), attempt {} of {}".format(outcome, len(r.content), attempt + 1, max_attempts))
+        logger.debug("page without listings json from %s:\n%s", url, r.text)
+
+    raise TypeError("extract_zillow_page_json() failed, aborting scraping run.")
+
+
+def iter_search_pages(urls, time_between_scrapes, max_workers=1, rate_limiter=None, cache=None):
+    """
+    Fetches search pages and yields their json in the same order as urls.
+
+    Arguments:
+        urls (list): search page urls to collect
+        time_between_scrapes (int): number of seconds to wait before making consecutive requests
+        max_workers (int): number of pages to fetch in parallel, 1 fetches them one after another
+        rate_limiter (RateLimiter): limiter shared by all requests, defaults to one request every time_between_scrapes seconds
+        cache (ResponseCache): pages are served from and saved to this cache
+    """
+    if rate_limiter is None:
+        rate_limiter = RateLimiter.from_interval(time_between_scrapes)
+
+    if max_workers <= 1:
+        for url in urls:
+            yield fetch_search_page(url, time_between_scrapes, rate_limiter=rate_limiter, cache=cache)[1]
+        return
+
+    def fetch(url):
+        return fetch_search_page(url, time_between_scrapes, rate_limiter=rate_limiter, cache=cache)[1]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch, url) for url in urls]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # stop any pages that haven't started yet if we error out or the caller stops early
+            for future in futures:
+                future.cancel()
+
+
+def find_new_minimum(data, past_minimums):
+    # get the new minimum price for the next iteration of the dynamic scraper
+
+    listing_json = data['props']['pageProps']['searchPageState']['cat1']['searchResults']['listResults']
+    attempt_num = 1
+    # if we aren't able to extract it from the last one, we move backwards until we can...
+
+    continue_run = True
+    while continue_run:
+
+        # if it is a non-nested listing, try extracting the price
+        if "units" not in list(listing_json[len(listing_json)-attempt_num].keys()):
+            try:
+                return float(listing_json[len(listing_json)-attempt_num]['unformattedPrice'])
+            except:
+                pass
+
+        # if it is a nested listing, go through more complex logic to extract the price...
+        else:
+            if len(listing_json[len(listing_json)-attempt_num]['units']) == 1:
+                # if there is only one unit, it is simple to extract the price...
+                price = listing_json[len(listing_json)-attempt_num]['units'][0]['price']
+                # convert to numeric
+                price = parse_price(price)
+                return price
+            elif len(listing_json[len(listing_json)-attempt_num]['units']) > 1:
+                # if there are multiple, take the bottom one that isn't less than past minimums (that way we don't end up in a loop)
+                unit_prices = [unit['price'] for unit in listing_json[len(listing_json)-attempt_num]['units']]
+                
+                # convert price strings to numeric
+                unit_prices = [parse_price(unit_price) for unit_price in unit_prices]
+
+                # remove all prices that are lower than previous minimums
+                unit_prices = [unit_price for unit_price in unit_prices if unit_price < max(past_minimums)]
+
+                # if there are still prices after filtering, get the lowest one
+                if unit_prices:
+                    return min(unit_prices)
+
+                # if there are not, move on                    
+                else:
+                    pass
+            else:
+                pass
+                # if there are no units there is a problem...move back one more
+
+        # if we weren't able to extract the minimum price from it, move on to the next one.    
+        attempt_num += 1
+    
+def trim_search_page(data):
+    # keeps only the listings of a search page, the rest of the __NEXT_DATA__ json (map results, regions, etc..) isn't used
+    return {"props": {"pageProps": {"searchPageState": {"cat1": {"searchResults": {"listResults": get_list_results(data)}}}}}}
+
+
+class CrawlCheckpoint:
+    """
+    Append-only journal of a zillow_scraper run, so an interrupted crawl can resume where it stopped.
+
+    Every collected page, the state of the price window loop and every expanded building
+    are written (and flushed to disk) as json lines as soon as they are collected. Only the
+    position of each page in the journal is kept in memory, pages are read back from the
+    file when they are needed.
+
+    Arguments:
+        path (str): location of the journal file, it is replayed if it already exists
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = None
+        self.pages = {}
+        self.expanded = {}
+
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                offset = 0
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a line cut short by a crash, everything before it is still good
+                        break
+                    self.apply(entry, offset)
+                    offset += len(line)
+            # drop the cut short line, so entries appended from here on start on a line of their own
+            if offset != os.path.getsize(path):
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+
+    def apply(self, entry, offset):
+        if entry["type"] == "state":
+            self.state = entry
+        elif entry["type"] == "page":
+            # a page is only remembered by where its line starts
+            self.pages[(entry["min_price"], entry["pg_num"])] = offset
+        elif entry["type"] == "expanded":
+            self.expanded[entry["detailed_url"]] = entry["units"]
+
+    def write(self, entry):
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        with self.lock:
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.apply(entry, offset)
+
+    def record_state(self, **state):
+        self.write(dict(state, type="state"))
+
+    def record_page(self, min_price, pg_num, data):
+        self.write({"type": "page", "min_price": min_price, "pg_num": pg_num, "data": trim_search_page(data)})
+
+    def record_expanded(self, detailed_url, units):
+        self.write({"type": "expanded", "detailed_url": detailed_url, "units": units})
+
+    def has_page(self, min_price, pg_num):
+        return (min_price, pg_num) in self.pages
+
+    def get_page(self, min_price, pg_num):
+        offset = self.pages.get((min_price, pg_num))
+        if offset is None:
+            return None
+        with self.lock, open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())["data"]
+
+    def iter_pages(self):
+        # all collected pages, in the order they were collected, streamed from the journal
+        offsets = set(self.pages.values())
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                if offset in offsets:
+                    yield json.loads(line)["data"]
+                offset += len(line)
+
+    def remove(self):
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def iter_search_results(city, property_type, time_between_scrapes, min_price=0, testing=False, max_workers=1, rate_limiter=None, cache=None, resume=None, partition="dynamic", map_bounds=None, progress=None, query=None):
+    """
+    Generator behind zillow_scraper(), yields each search page's json as soon as it is collected.
+
+    Takes the same arguments as zillow_scraper(), plus:
+        progress (dict): if given, kept up to date with the current "min_price" and "num_listings" of the run
+    """
+    if progress is None:
+        progress = {}
+    if query is None:
+        query = SearchQuery()
+    min_price = max(min_price, query.min_price)
+    progress["min_price"] = min_price
+
+    if partition in ["bisect", "tiles"]:
+        if resume is not None:
+            raise TypeError("resume is only supported with partition='dynamic'")
+        if rate_limiter is None:
+            rate_limiter = RateLimiter.from_interval(time_between_scrapes)
+
+        stats = {}
+        if partition == "bisect":
+            windows = plan_price_windows(city, property_type, time_between_scrapes, min_price=min_price, max_price=query.max_price, rate_limiter=rate_limiter, cache=cache, stats=stats, query=query)
+        else:
+            if map_bounds is None:
+                map_bounds = query.map_bounds
+            if map_bounds is None:
+                # start from the area zillow shows for the city
+                url = zillow_url_constructor(location=city, category=property_type, pg_num=1, min_price=min_price, query=query)
+                map_bounds = extract_map_bounds(fetch_search_page(url, time_between_scrapes, rate_limiter=rate_limiter, cache=cache)[1])
+                if map_bounds is None:
+                    raise TypeError("could not find the map bounds of {}, pass map_bounds".format(city))
+            windows = plan_map_tiles(city, property_type, time_between_scrapes, map_bounds, min_price=min_price, max_workers=max_workers, rate_limiter=rate_limiter, cache=cache, stats=stats, query=query)
+
+        yield from iter_planned_search_results(city, property_type, time_between_scrapes, windows, stats, max_workers=max_workers, rate_limiter=rate_limiter, cache=cache, progress=progress)
+        return
+    elif partition != "dynamic":
+        raise TypeError("invalid partition, must be either 'dynamic', 'bisect' or 'tiles'")
+
+    # the dynamic scraper walks the price axis upwards, it needs the cheapest listings first
+    if query.sort != "pricea":
+        raise TypeError("partition='dynamic' needs the results sorted by price, use sort='pricea' or another partition")
+
+    if rate_limiter is None:
+        rate_limiter = RateLimiter.from_interval(time_between_scrapes)
+
+    checkpoint = resume
+    if isinstance(checkpoint, str):
+        checkpoint = CrawlCheckpoint(checkpoint)
+    # as it is stored in the checkpoint's json
+    query_arguments = json.loads(json.dumps(query.arguments()))
+
+    # Validation
+    if property_type not in ["sale", "rent"]:
+        raise TypeError("property_type:", property_type,
+                        "is not valid, select either 'sale' or 'rent'")
+
+    # variables for the loop 
+    
+    run_dynamic_scraper = True
+    min_price = min_price
+    target_pages = 20
+    past_minimums = [0]
+
+    if checkpoint is not None and checkpoint.state is not None:
+        # --- pick up an interrupted run from its checkpoint ---
+        state = checkpoint.state
+        if state["city"] != city or state["property_type"] != property_type:
+            raise TypeError("checkpoint {} belongs to a different run ({} {})".format(checkpoint.path, state["city"], state["property_type"]))
+        if state.get("query", query_arguments) != query_arguments:
+            raise TypeError("checkpoint {} was made with different filters ({})".format(checkpoint.path, state["query"]))
+
+        progress["min_price"] = min_price = state["min_price"]
+        past_minimums = state["past_minimums"]
+        target_pages = state["target_pages"]
+        run_dynamic_scraper = state["run_dynamic_scraper"]
+        progress["num_listings"] = num_listings = state["num_listings"]
+        print("Resuming from checkpoint at min_price", min_price, "with", len(checkpoint.pages), "pages collected")
+
+        # hand back what was already collected before carrying on
+        yield from checkpoint.iter_pages()
+
+        if state["done"]:
+            return
+
+    else:
+        # the total number of listings comes with the first page of the first price window
+        num_listings = None
+
+    def record_state(done=False):
+        progress["min_price"] = min_price
+        progress["num_listings"] = num_listings
+        if checkpoint is not None:
+            checkpoint.record_state(
+                city=city, property_type=property_type, min_price=min_price, past_minimums=past_minimums,
+                target_pages=target_pages, run_dynamic_scraper=run_dynamic_scraper, num_listings=num_listings, done=done, query=query_arguments,
+            )
+
+    record_state()
+
+    # --- Run Dynamic Scraper --- 
+    # The idea here is to take chunks at a time...we set a minimum to max and sort in ascending....
+    # take the price of the last one, and set that to be the next minimum, collect and run again until all are collected....
+    # We know when to stop, when the total number of results are less than the max results (thats a sign we've hit the top)
+        # For this case, we'll also need to calculate the number of pages to collect so we don't over-do it. (originally removed from zillow_scraper.ipynb)
+
+    # Continue to run the scraper until the maximum number of listings is hit.
+    while True:
+        try:
+            pg_num = 1
+            data = checkpoint.get_page(min_price, pg_num) if checkpoint is not None else None
+
+            if data is None:
+                # collect the first page, find out how many more pages to collect....
+                #  construct the url given the minimum price, location, etc.. 
+                url = zillow_url_constructor(location=city, category=property_type, pg_num=pg_num, min_price=min_price, query=query)
+
+                r, data = fetch_search_page(url, time_between_scrapes, rate_limiter=rate_limiter, cache=cache)
+
+                # on the first request...check to see if it is the last sequence to run (are there 20 pages of data?)
+                num_listings, num_listings_per_page = extract_result_counts(data, r.text)
+                if progress.get("num_listings") is None:
+                    print("Total Listings:", num_listings)
+                pages_to_collect = math.ceil(num_listings/num_listings_per_page)
+                if pages_to_collect < 20:
+                    run_dynamic_scraper = False
+                    target_pages = pages_to_collect
+
+                # if in testing mode, return the first bit
+                if testing:
+                    progress["num_listings"] = num_listings
+                    yield data
+                    return
+
+                if checkpoint is not None:
+                    checkpoint.record_page(min_price, pg_num, data)
+                record_state()
+                yield data
+
+                if num_listings == 0:
+                    # nothing matches the search
+                    record_state(done=True)
+                    break
+
+            # collect all remaining pages of data, the pages of a window are independent so they can be fetched in parallel
+            # (skipping any that were already checkpointed)
+            pages = [
+                pg_num for pg_num in range(2, target_pages+1)
+                if checkpoint is None or not checkpoint.has_page(min_price, pg_num)
+            ]
+            urls = [
+                zillow_url_constructor(location=city, category=property_type, pg_num=pg_num, min_price=min_price, query=query)
+                for pg_num in pages
+            ]
+            for pg_num, data in zip(pages, iter_search_pages(urls, time_between_scrapes, max_workers=max_workers, rate_limiter=rate_limiter, cache=cache)):
+                if checkpoint is not None:
+                    checkpoint.record_page(min_price, pg_num, data)
+                yield data
+
+            if checkpoint is not None:
+                data = checkpoint.get_page(min_price, target_pages) or data
+
+            # after all the data has been collected...we need to find out the new minimum_price for the next round...
+            # use "data" since it is the from the last round.
+            past_minimums.append(min_price) # save the old minimum price
+            min_price = find_new_minimum(data, past_minimums = past_minimums) # set the new minimum price
+            record_state(done=not run_dynamic_scraper)
+
+            if not run_dynamic_scraper:
+                break
 
         # if there is an error, break the script, return whatever data was collected.
         except Exception as e:
+            if progress.get("num_listings") is None:
+                raise TypeError(
+                    "Error with getting the total number of listings")
             print("Error collecting data:", e)
+            progress["error"] = e
             break
 
+
+def probe_search_window(city, property_type, time_between_scrapes, url_args, rate_limiter=None, cache=None):
+    # fetches the first page of a search window, returns it with the number of results and pages the window has
+    url = zillow_url_constructor(location=city, category=property_type, pg_num=1, **url_args)
+    r, data = fetch_search_page(url, time_between_scrapes, rate_limiter=rate_limiter, cache=cache)
+    num_listings, num_listings_per_page = extract_result_counts(data, r.text)
+    return data, num_listings, math.ceil(num_listings / num_listings_per_page)
+
+
+def plan_price_windows(city, property_type, time_between_scrapes, min_price=0, max_price=None, max_pages=20, rate_limiter=None, cache=None, stats=None, query=None):
+    """
+    Splits the price axis into windows that each fit under zillow's page cap.
+
+    Starting from [min_price, max_price], the first page of a window is fetched to get its
+    result count; windows with more results than max_pages pages can show are bisected
+    (open ended windows are split at double their minimum) until every window fits. Windows
+    don't overlap, so listings are only fetched once, unless many listings share a single
+    price, in which case that one dollar window is kept and truncated at max_pages.
+
+    Arguments:
+        city (str): city name
+        property_type (str): either "sale" or "rent"
+        time_between_scrapes (int): number of seconds to wait before making consecutive requests
+        min_price (int): lower end of the price axis
+        max_price (int): upper end of the price axis, None for no upper limit
+        max_pages (int): the number of pages zillow will return for a search
+        rate_limiter (RateLimiter): limiter every request goes through
+        cache (ResponseCache): search pages are served from and saved to this cache
+        stats (dict): if given, the number of "requests" made and the "probes" among them (first pages of windows that had to be split) are added to it
+        query (SearchQuery): the other filters of every window
+    Yields:
+        window (dict): "url_args" for zillow_url_constructor(), "num_listings", "pages" to collect, and the already fetched "first_page"
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("requests", 0)
+    stats.setdefault("probes", 0)
+
+    windows = [(int(min_price), None if max_price is None else int(max_price))]
+    while windows:
+        low, high = windows.pop(0)
+
+        url_args = {"min_price": low, "max_price": high, "query": query}
+        data, num_listings, pages = probe_search_window(city, property_type, time_between_scrapes, url_args, rate_limiter=rate_limiter, cache=cache)
+        stats["requests"] += 1
+
+        if pages <= max_pages or (high is not None and high <= low):
+            if pages > max_pages:
+                print("Warning: {} listings priced at {}, only the first {} pages can be collected".format(num_listings, low, max_pages))
+            yield {"url_args": url_args, "num_listings": num_listings, "pages": min(pages, max_pages), "first_page": data}
+            continue
+
+        # too many results for one window, split it (prices are whole dollars, so [low, middle] and [middle + 1, high] don't overlap)
+        stats["probes"] += 1
+        if high is None:
+            middle = max(low * 2, low + 1000)
+        else:
+            middle = (low + high) // 2
+        windows[:0] = [(low, middle), (middle + 1, high)]
+
+
+def extract_map_bounds(data):
+    # the map area a search page covers, as a dict of west/east/south/north coordinates
+    try:
+        return dict(data['props']['pageProps']['searchPageState']['queryState']['mapBounds'])
+    except (KeyError, TypeError):
+        return None
+
+
+def split_map_bounds(map_bounds):
+    # quarters a map area (the quadtree step of plan_map_tiles())
+    middle_longitude = (map_bounds["west"] + map_bounds["east"]) / 2
+    middle_latitude = (map_bounds["south"] + map_bounds["north"]) / 2
+    return [
+        {"west": west, "east": east, "south": south, "north": north}
+        for west, east in [(map_bounds["west"], middle_longitude), (middle_longitude, map_bounds["east"])]
+        for south, north in [(map_bounds["south"], middle_latitude), (middle_latitude, map_bounds["north"])]
+    ]
+
+
+def plan_map_tiles(city, property_type, time_between_scrapes, map_bounds, min_price=0, max_pages=20, max_depth=10, max_workers=1, rate_limiter=None, cache=None, stats=None, query=None):
+    """
+    Splits a map area into tiles that each fit under zillow's page cap.
+
+    The first page of every tile is fetched to get its result count, tiles with more
+    results than max_pages pages can show are quartered (a quadtree) until every tile fits,
+    or max_depth splits have been made. The tiles of each level are probed in parallel with
+    max_workers threads.
+
+    Arguments:
+        city (str): city name
+        property_type (str): either "sale" or "rent"
+        time_between_scrapes (int): number of seconds to wait before making consecutive requests
+        map_bounds (dict): west/east/south/north coordinates of the area to cover
+        min_price (int): the minimum price to filter on
+        max_pages (int): the number of pages zillow will return for a search
+        max_depth (int): how many times a tile can be quartered
+        max_workers (int): number of tiles to probe in parallel
+        rate_limiter (RateLimiter): limiter every request goes through
+        cache (ResponseCache): search pages are served from and saved to this cache
+        stats (dict): if given, the number of "requests" made and the "probes" among them (first pages of tiles that had to be split) are added to it
+        query (SearchQuery): the other filters of every tile
+    Yields:
+        tile (dict): "url_args" for zillow_url_constructor(), "num_listings", "pages" to collect, and the already fetched "first_page"
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("requests", 0)
+    stats.setdefault("probes", 0)
+
+    def probe(tile):
+        url_args = {"min_price": min_price, "map_bounds": tile, "query": query}
+        return url_args, probe_search_window(city, property_type, time_between_scrapes, url_args, rate_limiter=rate_limiter, cache=cache)
+
+    level = [map_bounds]
+    depth = 0
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        while level:
+            next_level = []
+            for url_args, (data, num_listings, pages) in executor.map(probe, level):
+                stats["requests"] += 1
+
+                if pages <= max_pages or depth >= max_depth:
+                    if pages > max_pages:
+                        print("Warning: {} listings in tile {}, only the first {} pages can be collected".format(num_listings, url_args["map_bounds"], max_pages))
+                    yield {"url_args": url_args, "num_listings": num_listings, "pages": min(pages, max_pages), "first_page": data}
+                else:
+                    stats["probes"] += 1
+                    next_level.extend(split_map_bounds(url_args["map_bounds"]))
+
+            level = next_level
+            depth += 1
+
+
+def iter_planned_search_results(city, property_type, time_between_scrapes, windows, stats, max_workers=1, rate_limiter=None, cache=None, progress=None):
+    """
+    Collects the search windows planned by plan_price_windows() or plan_map_tiles(), yielding each search page's json as it is collected.
+
+    When done, progress holds the number of "requests" made, the "probes" among them,
+    the "unique_listings" and "duplicate_listings" seen, and the "minimum_requests" the
+    unique listings could have been collected with.
+    """
+    if progress is None:
+        progress = {}
+
+    seen_keys = set()
+    duplicate_listings = 0
+    num_listings_per_page = 0
+
+    def count_listings(data):
+        nonlocal duplicate_listings
+        for item in get_list_results(data):
+            key = listing_key(item)
+            if key in seen_keys:
+                duplicate_listings += 1
+            else:
+                seen_keys.add(key)
+
+    for window in windows:
+        progress["min_price"] = window["url_args"]["min_price"]
+        progress["num_listings"] = progress.get("num_listings", 0) + window["num_listings"]
+
+        data = window.pop("first_page")
+        num_listings_per_page = max(num_listings_per_page, len(get_list_results(data)))
+        count_listings(data)
+        yield data
+
+        urls = [
+            zillow_url_constructor(location=city, category=property_type, pg_num=pg_num, **window["url_args"])
+            for pg_num in range(2, window["pages"] + 1)
+        ]
+        for data in iter_search_pages(urls, time_between_scrapes, max_workers=max_workers, rate_limiter=rate_limiter, cache=cache):
+            stats["requests"] += 1
+            count_listings(data)
+            yield data
+
+    progress["requests"] = stats["requests"]
+    progress["probes"] = stats["probes"]
+    progress["unique_listings"] = len(seen_keys)
+    progress["duplicate_listings"] = duplicate_listings
+    progress["minimum_requests"] = math.ceil(len(seen_keys) / num_listings_per_page) if num_listings_per_page else 0
+    print("Collected {unique_listings} listings ({duplicate_listings} duplicates) in {requests} requests, the minimum is {minimum_requests}".format(**progress))
+
+
+def zillow_scraper(city, property_type, time_between_scrapes, min_price, testing, max_workers=1, rate_limiter=None, cache=None, resume=None, partition="dynamic", map_bounds=None, query=None):
+    """
+
+    Collects all data available for a given city (either rental or sales). 
+
+    Arguments:
+        city (str): city name
+        property_type (str): either "sale" or "rent"
+        time_between_scrapes (int): number of seconds to wait before making consecutive requests
+        min_price (int): the minimum price to start filtering on, useful to continue scraping if it is interrupted.
+        testing (bool): if true, will return only the first page
+        max_workers (int): number of pages of a price window to fetch in parallel once the first page is collected
+        rate_limiter (RateLimiter): limiter shared by every request of the run, defaults to one request every time_between_scrapes seconds
+        cache (ResponseCache): search pages are served from and saved to this cache
+        resume (str or CrawlCheckpoint): journal the run is checkpointed to after every page, if it already has progress the run picks up from there
+        partition (str): how the price axis is walked, "dynamic" moves the minimum price up to the last listing of each 20 page window,
+            "bisect" plans non-overlapping windows from result counts (see plan_price_windows()),
+            "tiles" splits the map into tiles instead (see plan_map_tiles()), which also works when many listings share a price
+        map_bounds (dict): west/east/south/north coordinates of the area to tile, defaults to the area zillow shows for the city
+        query (SearchQuery): filters zillow applies to the search (beds, baths, sqft, home types, price range, ...), only matching listings are collected
+    Returns:
+        data_dict (dict): collection of extracted data
+
+    """
+    progress = {}
+    data_list = list(iter_search_results(
+        city, property_type, time_between_scrapes, min_price=min_price, testing=testing, max_workers=max_workers,
+        rate_limiter=rate_limiter, cache=cache, resume=resume, partition=partition, map_bounds=map_bounds, progress=progress, query=query,
+    ))
+
     data_dict = {
         "data_list":data_list,
-        "min_price":min_price,
-        "num_listings":num_listings
+        "min_price":progress["min_price"],
+        "num_listings":progress.get("num_listings")
         }
 
     return data_dict
 
 
+def listing_key(item):
+    # identifies a search result across overlapping price windows
+    return item.get("zpid") or item.get("detailUrl")
+
+
+fingerprint_fields = ["unformattedPrice", "price", "statusType", "statusText", "beds", "baths", "area", "units"]
+
+
+def listing_fingerprint(item):
+    # changes whenever the price/status of a search result (or of one of its units) changes
+    values = {field: item.get(field) for field in fingerprint_fields}
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+@timed_stage("flatten")
+def flatten_listing(item, property_type, extra_schema=None):
+    # a rental search result becomes a make_frame_rentals_detail row, a sale the sale_schema columns
+    # extra_schema (see make_schema()) adds columns to either
+    if property_type == "rent":
+        record = rental_detail_record(item)
+        if extra_schema:
+            record.update(project_listing(item, extra_schema))
+        return record
+    return project_listing(item, sale_schema + extra_schema if extra_schema else sale_schema)
+
+
+def iter_listings(city, property_type, time_between_scrapes=120, min_price=0, deduplicate=True, fingerprint=False, extra_fields=None, **kwargs):
+    """
+    Streams the flattened listings of a city as the search pages arrive.
+
+    Each page's raw json is dropped as soon as its listings are flattened, so memory use
+    doesn't grow with the size of the city and writers downstream can start straight away.
+
+    Arguments:
+        city (str): city name
+        property_type (str): either "sale" or "rent"
+        time_between_scrapes (int): number of seconds to wait before making consecutive requests
+        min_price (int): the minimum price to start filtering on
+        deduplicate (bool): skip listings already yielded by an overlapping price window
+        fingerprint (bool): add the "listing_key" and "listing_fingerprint" (see listing_fingerprint()) of the search result to each listing
+        extra_fields (dict): more fields of the search result to add as columns, column -> path or (path, coerce), see make_schema()
+        **kwargs: any other zillow_scraper() argument (max_workers, rate_limiter, cache, resume, ...)
+    Yields:
+        listing (dict): a row of make_frame_rentals_detail() for rentals, the sale_schema columns for sales
+    """
+    extra_schema = make_schema(extra_fields)
+    seen_keys = set()
+    for data in iter_search_results(city, property_type, time_between_scrapes, min_price=min_price, **kwargs):
+        list_results = get_list_results(data)
+        del data
+
+        for item in list_results:
+            if deduplicate:
+                key = listing_key(item)
+                if key is not None:
+                    if key in seen_keys:
+                        continue
+                    seen_keys.add(key)
+            try:
+                listing = flatten_listing(item, property_type, extra_schema)
+            except (KeyError, TypeError):
+                # same as the frame builders, skip listings missing the fields we need
+                continue
+            if fingerprint:
+                listing["listing_key"] = listing_key(item)
+                listing["listing_fingerprint"] = listing_fingerprint(item)
+            get_metrics().increment("listings")
+            yield listing
+
+
+class SnapshotStore:
+    """
+    What the last delta run of a location/property type saw, kept as a json file.
+
+    listings maps each listing_key() to its "fingerprint" and "detailed_url", units maps
+    the building pages expanded by rental_frame_expander() to their unit records and
+    hoa_fees maps sale detail pages to the fee get_hoa_fee() found. The file is only
+    replaced by save(), so an interrupted run leaves the previous snapshot in place.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.listings = {}
+        self.units = {}
+        self.hoa_fees = {}
+
+        if os.path.exists(path):
+            with open(path) as f:
+                snapshot = json.load(f)
+            self.listings = snapshot.get("listings", {})
+            self.units = snapshot.get("units", {})
+            self.hoa_fees = snapshot.get("hoa_fees", {})
+
+    def compare(self, key, fingerprint):
+        # "added", "changed" or "unchanged" compared to the last snapshot
+        previous = self.listings.get(key)
+        if previous is None:
+            return "added"
+        if previous["fingerprint"] != fingerprint:
+            return "changed"
+        return "unchanged"
+
+    def save(self, listings, units, hoa_fees):
+        self.listings = listings
+        self.units = units
+        self.hoa_fees = hoa_fees
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"listings": listings, "units": units, "hoa_fees": hoa_fees}, f)
+        os.replace(temp_path, self.path)
+
+
 def extract_floor_plans(data):
     if isinstance(data, dict):
         if "floorPlans" in data:
@@ -522,237 +2193,953 @@ def extract_floor_plans(data):
                 return result
     return None
 
-def get_units_from_detailed_url(detailed_url):
+def get_units_from_detailed_url(detailed_url, rate_limiter=None, driver_pool=None, fetch_tiers=None, cache=None):
+    # the units of a building page, raises TypeError if neither plain http nor the browser got its floor plans
+    # try plain http first, only use selenium when the floor plans aren't in the response
+    target_url = "{base_url}{detailed_url}".format(base_url=base_url, detailed_url=detailed_url)
+    data_dict = fetch_next_data(
+        target_url,
+        rate_limiter=rate_limiter,
+        driver_pool=driver_pool,
+        is_complete=lambda data: extract_floor_plans(data) is not None,
+        fetch_tiers=fetch_tiers,
+        cache=cache,
+    )
+
+    # Check if the script tag was found
+    if data_dict is None:
+        raise TypeError("Script tag not found on {}".format(target_url))
+
+    floor_plans = extract_floor_plans(data_dict)
+    if floor_plans is None:
+        raise TypeError("No floor plans on {}".format(target_url))
+
+    # convert dictionary to pandas dataframe with relevant data
+    unit_number = []
+    price = []
+    sqft = []
+    baths = []
+    beds = []
+    available_from = []
+    for unit in floor_plans:
+        try:
+            unit_number.append(unit['units'][0]['unitNumber'])
+        except:
+            unit_number.append(None)
+        try:
+            price.append(unit['units'][0]['price'])
+        except:
+            price.append(None)
+        try:
+            sqft.append(unit['units'][0]['sqft'])
+        except:
+            sqft.append(None)
+        try:
+            baths.append(unit['baths'])
+        except:
+            baths.append(None)
+        try:
+            beds.append(unit['beds'])
+        except:
+            beds.append(None)
+        try:
+            available_from.append(unit['units'][0]['availableFrom'])
+        except:
+            available_from.append(None)
+
+    df = pd.DataFrame()
+    df['unit_number'] = unit_number
+    df['price'] = price
+    df['sqft'] = sqft
+    df['baths'] = baths
+    df['beds'] = beds
+    df['available_from'] = available_from
+
+    return df
+
+
+expanded_building_columns = ["unit_description", "detailed_url", "latitude", "longitude", "unit_address", "unit_address_street", "unit_city", "unit_zipcode"]
+
+
+def rental_frame_expander(frame, time_to_sleep, rate_limiter=None, driver_pool=None, fetch_tiers=None, cache=None, checkpoint=None, unit_store=None, max_workers=1):
+    # takes output from make_frame_rentals_detail
+    # each nested building is expanded once, max_workers buildings at a time, and its units are added as "expanded" rows
+    # buildings already expanded in checkpoint (CrawlCheckpoint) are reused, new ones are recorded to it
+    # unit_store (dict) works the same way across batches and runs: building url -> unit records, reused when present and filled in otherwise
+    # buildings whose page couldn't be fetched are left out of both, so the next batch/run fetches them again
+    # fetch_tiers (dict) records whether each building page was served by plain http or the browser
+    # every building page is requested through rate_limiter, by default one every time_to_sleep seconds
+    if rate_limiter is None:
+        rate_limiter = RateLimiter.from_interval(time_to_sleep)
+    if unit_store is None:
+        unit_store = {}
+
+    # besides its location/address, a unit gets any extra column (see make_schema()) of its building
+    building_columns = expanded_building_columns + [column for column in frame.columns if column not in rental_detail_columns]
+
+    # given a rental frame with nested and regular data, we want to get all units for each building, once
+    already_collected_unit_urls = set(frame.loc[frame.listing_type == "expanded", 'detailed_url'])
+    nested = frame[(frame.listing_type == "nested") & ~frame['detailed_url'].astype(str).str.contains(".com", regex=False)]
+    nested = nested[~nested['detailed_url'].isin(already_collected_unit_urls)]
+    buildings = nested.drop_duplicates(subset='detailed_url')
+
+    urls_to_fetch = []
+    for url in buildings['detailed_url']:
+        if checkpoint is not None and url in checkpoint.expanded:
+            unit_store[url] = checkpoint.expanded[url]
+        elif url not in unit_store:
+            urls_to_fetch.append(url)
+
+    def expand_building(url):
+        try:
+            return get_units_from_detailed_url(url, rate_limiter=rate_limiter, driver_pool=driver_pool, fetch_tiers=fetch_tiers, cache=cache)
+        except Exception as e:
+            print("Error in get_units_from_detailed_url:", url, e)
+            return None
+
+    if max_workers > 1 and len(urls_to_fetch) > 1:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        building_frames = executor.map(expand_building, urls_to_fetch)
+    else:
+        executor = None
+        building_frames = map(expand_building, urls_to_fetch)
+
+    failed = 0
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Accept-Language": "en-US,en;q=0.9",
-        }
-        # use selenium to extract the html from the site
-        driver = webdriver.Chrome()
+        for url, building_data in zip(urls_to_fetch, building_frames):
+            if building_data is None:
+                failed += 1
+                continue
+            units = building_data.astype(object).where(building_data.notna(), None).to_dict("records")
+            unit_store[url] = units
+            if checkpoint is not None:
+                checkpoint.record_expanded(url, units)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if failed:
+        print("{} of {} building pages failed, their units are missing from this batch".format(failed, len(urls_to_fetch)))
+
+    unit_frames = [
+        pd.DataFrame(unit_store[url], columns=unit_columns).assign(detailed_url=url)
+        for url in buildings['detailed_url'] if unit_store.get(url)
+    ]
+    if not unit_frames:
+        return frame
+
+    # attach the building's location/address to each of its units
+    units = pd.concat(unit_frames, ignore_index=True).rename(columns={"sqft": "area"})
+    expanded = units.merge(buildings[building_columns], on="detailed_url", how="left")
+    expanded.insert(0, "listing_type", "expanded")
+    expanded = expanded[["listing_type"] + expanded_building_columns + ["beds", "baths", "area", "price", "unit_number"] + building_columns[len(expanded_building_columns):]]
+
+    return pd.concat([frame, expanded], ignore_index=True)
+
+
+def arrow_safe_frame(frame):
+    """
+    Returns a copy of frame that can be written to parquet/feather.
 
-        target_url = "https://www.zillow.com{detailed_url}".format(detailed_url=detailed_url)
-        # open the page
-        driver.get(target_url)
-        html_content = driver.page_source
-        driver.quit()
+    latLong is split into latitude/longitude columns, other nested values (carouselPhotos,
+    variableData, ...) are stored as json strings and columns mixing types (ie. "$3,000+"
+    unit prices next to numeric ones) are stored as strings.
+    """
+    frame = frame.copy()
+
+    if "latLong" in frame.columns:
+        frame["latitude"] = frame["latLong"].map(lambda value: value.get("latitude") if isinstance(value, dict) else None)
+        frame["longitude"] = frame["latLong"].map(lambda value: value.get("longitude") if isinstance(value, dict) else None)
+        frame = frame.drop(columns=["latLong"])
+
+    for column in frame.columns:
+        if frame[column].dtype != object:
+            continue
+        values = frame[column].dropna()
+        value_types = set(values.map(type))
+        if value_types & {dict, list}:
+            frame[column] = frame[column].map(lambda value: json.dumps(value) if isinstance(value, (dict, list)) else value)
+            value_types = set(frame[column].dropna().map(type))
+        if len(value_types) > 1:
+            frame[column] = frame[column].map(lambda value: None if value is None or value != value else str(value))
 
-        soup = BeautifulSoup(html_content, 'html.parser')
+    return frame
+
+
+class CsvSink:
+    """
+    Appends batches of rows to a single csv file.
 
-        # extract the building info
-        script_tag = soup.find("script", id="__NEXT_DATA__")
+    The columns of the first batch fix the layout of the file, later batches are
+    reindexed to it.
+    """
 
-        # Check if the script tag was found
-        if script_tag:
-            # Extract the content of the <script> tag
-            script_content = script_tag.string
+    def __init__(self, path):
+        self.path = path
+        self.columns = None
+        self.rows_written = 0
+
+    def write(self, frame):
+        frame = frame.copy()
+        frame.index = range(self.rows_written, self.rows_written + len(frame))
+        if self.columns is None:
+            self.columns = list(frame.columns)
+            frame.to_csv(self.path, mode="w")
         else:
-            print("Script tag not found.")
-        
-        data_dict = json.loads(script_content)
-
-        floor_plans = extract_floor_plans(data_dict)
-
-        # convert dictionary to pandas dataframe with relevant data
-        unit_number = []
-        price = []
-        sqft = []
-        baths = []
-        beds = []
-        available_from = []
-        for unit in floor_plans:
-            try:
-                unit_number.append(unit['units'][0]['unitNumber'])
-            except:
-                unit_number.append(None)
-            try:
-                price.append(unit['units'][0]['price'])
-            except:
-                price.append(None)
-            try:
-                sqft.append(unit['units'][0]['sqft'])
-            except:
-                sqft.append(None)
-            try:
-                baths.append(unit['baths'])
-            except:
-                baths.append(None)
-            try:
-                beds.append(unit['beds'])
-            except:
-                beds.append(None)
-            try:
-                available_from.append(unit['units'][0]['availableFrom'])
-            except:
-                available_from.append(None)
-
-        df = pd.DataFrame()
-        df['unit_number'] = unit_number
-        df['price'] = price
-        df['sqft'] = sqft
-        df['baths'] = baths
-        df['beds'] = beds
-        df['available_from'] = available_from
-        
-    except Exception as e:
-        print("Error in get_units_from_detailed_url:", e)
-        traceback.print_exc()
-        df = pd.DataFrame()
-        df['unit_number'] = []
-        df['price'] = []
-        df['sqft'] = []
-        df['baths'] = []
-        df['beds'] = []
-        df['available_from'] = []
+            frame.reindex(columns=self.columns).to_csv(self.path, mode="a", header=False)
+        self.rows_written += len(frame)
 
-    return df
+    def close(self):
+        pass
 
 
-def rental_frame_expander(frame, time_to_sleep):
-    # takes output from make_frame_rentals_detail
+def unify_arrow_schemas(schemas):
+    # one schema every part can be cast to: null columns take the type seen elsewhere, mixed numbers become floats, anything else mixed becomes strings
+    import pyarrow as pa
 
-    new_frames = []
+    field_types = {}
+    for schema in schemas:
+        for field in schema:
+            field_types.setdefault(field.name, []).append(field.type)
 
-    already_collected_unit_urls = list(set(list(frame[frame.listing_type == "expanded"]['detailed_url'])))
+    fields = []
+    for name, types in field_types.items():
+        types = set(field_type for field_type in types if not pa.types.is_null(field_type))
+        if len(types) == 1:
+            field_type = types.pop()
+        elif types and all(pa.types.is_integer(field_type) or pa.types.is_floating(field_type) for field_type in types):
+            field_type = pa.float64()
+        else:
+            field_type = pa.string()
+        fields.append(pa.field(name, field_type))
 
-    # given a rental frame with nested and regular data, we want to get all units for each building
-    for x in range(0, len(frame['listing_type'])):
-        row = frame.iloc[x]
-        if row['listing_type'] == "nested" and ".com" not in row['detailed_url']:
-            try:
-                # since we run this in a loop, we need to check if it has already been collected.....
-                if row['detailed_url'] in already_collected_unit_urls:
-                    pass
+    return pa.schema(fields)
+
+
+class ParquetSink:
+    """
+    Writes each batch as a new parquet file in a hive style partition directory.
+
+    Files go to output_directory/location=.../property_type=.../scrape_date=.../part-00000.parquet,
+    so readers (pandas, pyarrow, spark, duckdb) can load only the partitions and columns they
+    need. Parts left in the partition by an earlier run of the same day are replaced once the
+    first batch is written, so a run that collects nothing leaves them in place, and on
+    close() parts are rewritten to a common schema if batches disagreed on column types.
+    Requires pyarrow.
+    """
+    extension = ".parquet"
+
+    def __init__(self, output_directory, partition):
+        self.directory = os.path.join(output_directory, *["{}={}".format(key, value) for key, value in partition.items()])
+        self.paths = []
+
+    def remove_old_parts(self):
+        if os.path.isdir(self.directory):
+            for file_name in os.listdir(self.directory):
+                if file_name.startswith("part-") and file_name.endswith(self.extension):
+                    os.remove(os.path.join(self.directory, file_name))
+
+    def write(self, frame):
+        if len(frame) == 0:
+            return
+        import pyarrow as pa
+
+        if not self.paths:
+            self.remove_old_parts()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "part-{:05d}{}".format(len(self.paths), self.extension))
+        table = pa.Table.from_pandas(arrow_safe_frame(frame), preserve_index=False)
+        self.write_table(table, path)
+        self.paths.append(path)
+
+    def write_table(self, table, path):
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+
+    def read_table(self, path):
+        import pyarrow.parquet as pq
+        return pq.read_table(path)
+
+    def close(self):
+        import pyarrow as pa
+
+        tables = [self.read_table(path).replace_schema_metadata() for path in self.paths]
+        schema = unify_arrow_schemas([table.schema for table in tables])
+        for path, table in zip(self.paths, tables):
+            if table.schema.equals(schema):
+                continue
+            columns = [
+                table.column(field.name) if field.name in table.column_names else pa.nulls(len(table), field.type)
+                for field in schema
+            ]
+            table = pa.Table.from_arrays(columns, names=schema.names).cast(schema)
+            self.write_table(table, path)
+
+
+class FeatherSink(ParquetSink):
+    """
+    Same as ParquetSink, but writes Arrow IPC (feather) files.
+    """
+    extension = ".feather"
+
+    def write_table(self, table, path):
+        import pyarrow.feather as feather
+        feather.write_feather(table, path)
+
+    def read_table(self, path):
+        import pyarrow.feather as feather
+        return feather.read_table(path)
+
+
+# the columns ListingStore keeps for each property type: id, unit number, zipcode, price and status
+store_columns = {
+    "sale": {"listing_id": "zpid", "unit_number": None, "zipcode": "addressZipcode", "price": "unformattedPrice", "status": "statusType"},
+    "rent": {"listing_id": "detailed_url", "unit_number": "unit_number", "zipcode": "unit_zipcode", "price": "price", "status": None},
+}
+
+store_record_columns = ["key", "location", "property_type", "listing_id", "unit_number", "zipcode", "latitude", "longitude", "price", "status", "scrape_date", "data"]
+
+
+class ListingStore:
+    """
+    Every listing collect_real_estate_data() has written, kept in an indexed SQLite database.
+
+    The listings table holds the latest row of each listing, sales keyed on their zpid and
+    rentals on detailed_url and unit_number, with the whole row as json in "data". The
+    listing_history table gets a row whenever a listing is first seen or its price/status
+    changes, so looking up what a listing cost on a given date doesn't mean loading every
+    dated csv. Each frame is upserted in a single transaction.
+
+    Arguments:
+        path (str): location of the SQLite database file
+        timeout (int): seconds to wait on a write of another connection (ie. another job of the run)
+    """
+
+    def __init__(self, path="zillow_listings.sqlite", timeout=60):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS listings ("
+                "key TEXT PRIMARY KEY, location TEXT, property_type TEXT, listing_id TEXT, unit_number TEXT, "
+                "zipcode TEXT, latitude REAL, longitude REAL, price REAL, status TEXT, first_seen TEXT, last_seen TEXT, data TEXT)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS listing_history ("
+                "key TEXT, scrape_date TEXT, price REAL, status TEXT, PRIMARY KEY (key, scrape_date))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS listings_location ON listings (location, property_type)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS listings_zipcode ON listings (zipcode)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS listings_last_seen ON listings (last_seen)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS listings_listing_id ON listings (listing_id)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS listing_history_scrape_date ON listing_history (scrape_date)")
+
+    def make_key(self, listing_id, unit_number=None):
+        if unit_number is None or unit_number == "":
+            return str(listing_id)
+        return "{}#{}".format(listing_id, unit_number)
+
+    def make_records(self, frame, location, property_type, scrape_date):
+        # one tuple per row, in the order of store_record_columns
+        if property_type not in store_columns:
+            raise TypeError("invalid property_type, must be either 'rent' or 'sale'")
+        columns = store_columns[property_type]
+
+        def column(name):
+            if name is None or name not in frame.columns:
+                return pd.Series(None, index=frame.index, dtype=object)
+            return frame[name]
+
+        records = pd.DataFrame(index=frame.index)
+        listing_ids = column(columns["listing_id"])
+        records["listing_id"] = listing_ids.astype(str).where(listing_ids.notna(), None)
+        unit_numbers = column(columns["unit_number"])
+        records["unit_number"] = unit_numbers.astype(object).where(unit_numbers.notna(), "").astype(str)
+        records["key"] = records["listing_id"].astype(str).where(records["unit_number"] == "", records["listing_id"].astype(str) + "#" + records["unit_number"])
+        records["location"] = location
+        records["property_type"] = property_type
+        zipcodes = column(columns["zipcode"])
+        records["zipcode"] = zipcodes.astype(object).where(zipcodes.notna(), None)
+        records["latitude"] = pd.to_numeric(column("latitude"), errors="coerce")
+        records["longitude"] = pd.to_numeric(column("longitude"), errors="coerce")
+        records["price"] = parse_numbers(column(columns["price"]).astype(object))
+        statuses = column(columns["status"])
+        records["status"] = statuses.astype(object).where(statuses.notna(), None)
+        records["scrape_date"] = scrape_date
+        # to_json turns NaN/NA into null and dates into iso strings, one line per row
+        records["data"] = frame.to_json(orient="records", lines=True, date_format="iso").splitlines() if len(frame) else []
+
+        records = records[records["listing_id"].notna()].drop_duplicates("key", keep="last")
+        records = records[store_record_columns].astype(object)
+        records = records.where(records.notna(), None)
+        return list(records.itertuples(index=False, name=None))
+
+    def write(self, frame, location, property_type, scrape_date):
+        """
+        Upserts the rows of frame, as written out by collect_location_data(), for a scrape date.
+
+        Arguments:
+            frame (pd.DataFrame): sale or expanded rental rows
+            location (str): location the rows were collected for
+            property_type (str): "rent" or "sale"
+            scrape_date (str): date of the scrape, "YYYY-MM-DD"
+        Returns:
+            rows (int): number of listings upserted
+        """
+        records = self.make_records(frame, location, property_type, scrape_date)
+        if not records:
+            return 0
+
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS incoming ({})".format(", ".join(store_record_columns)))
+            self.connection.execute("DELETE FROM incoming")
+            self.connection.executemany("INSERT INTO incoming VALUES ({})".format(", ".join("?" * len(store_record_columns))), records)
+            # history first, while listings still has the previous price/status
+            self.connection.execute(
+                "INSERT OR REPLACE INTO listing_history (key, scrape_date, price, status) "
+                "SELECT incoming.key, incoming.scrape_date, incoming.price, incoming.status FROM incoming "
+                "LEFT JOIN listings ON listings.key = incoming.key "
+                "WHERE listings.key IS NULL OR listings.price IS NOT incoming.price OR listings.status IS NOT incoming.status"
+            )
+            self.connection.execute(
+                "INSERT INTO listings (key, location, property_type, listing_id, unit_number, zipcode, latitude, longitude, price, status, first_seen, last_seen, data) "
+                "SELECT key, location, property_type, listing_id, unit_number, zipcode, latitude, longitude, price, status, scrape_date, scrape_date, data FROM incoming WHERE true "
+                "ON CONFLICT (key) DO UPDATE SET location = excluded.location, zipcode = excluded.zipcode, latitude = excluded.latitude, "
+                "longitude = excluded.longitude, price = excluded.price, status = excluded.status, data = excluded.data, "
+                "first_seen = MIN(first_seen, excluded.first_seen), last_seen = MAX(last_seen, excluded.last_seen)"
+            )
+            self.connection.execute("DELETE FROM incoming")
+        return len(records)
+
+    def import_csv(self, path):
+        # loads a csv written by collect_real_estate_data(), named {location}_{property_type}_{date}.csv, import older files first
+        match = re.match(r"(.+)_(rent|sale)_(\d{4}-\d{2}-\d{2})\.csv$", os.path.basename(path))
+        if match is None:
+            raise TypeError("csv file name must be {location}_{property_type}_{date}.csv")
+        location, property_type, scrape_date = match.groups()
+        frame = pd.read_csv(path, index_col=0, dtype={"zpid": str, "unit_number": str, "addressZipcode": str, "unit_zipcode": str})
+        return self.write(frame, location, property_type, scrape_date)
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return pd.read_sql_query(sql, self.connection, params=parameters)
+
+    def listings(self, location=None, property_type=None, zipcode=None, seen_since=None):
+        """
+        Returns the latest row of the listings matching every filter given, data holds the whole row as json.
+
+        Arguments:
+            location (str): location the listings were collected for
+            property_type (str): "rent" or "sale"
+            zipcode (str): zipcode of the listing
+            seen_since (str): only listings seen on or after this date, "YYYY-MM-DD"
+        """
+        conditions = []
+        parameters = []
+        for condition, value in [("location = ?", location), ("property_type = ?", property_type), ("zipcode = ?", zipcode), ("last_seen >= ?", seen_since)]:
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return self.query("SELECT * FROM listings" + where, parameters)
+
+    def history(self, listing_id, unit_number=None):
+        # price/status changes of a listing (zpid, or detailed_url and unit_number of a rental), oldest first
+        return self.query(
+            "SELECT scrape_date, price, status FROM listing_history WHERE key = ? ORDER BY scrape_date",
+            (self.make_key(listing_id, unit_number),),
+        )
+
+    def price_on(self, listing_id, date, unit_number=None):
+        # price of a listing as of date ("YYYY-MM-DD"), None if it hadn't been seen yet
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT price FROM listing_history WHERE key = ? AND scrape_date <= ? ORDER BY scrape_date DESC LIMIT 1",
+                (self.make_key(listing_id, unit_number), date),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class ListingStoreSink:
+    """
+    Upserts each batch of a location/property type into a ListingStore.
+    """
+
+    def __init__(self, store, location, property_type, scrape_date, close_store=False):
+        self.store = store
+        self.location = location
+        self.property_type = property_type
+        self.scrape_date = scrape_date
+        self.close_store = close_store
+
+    def write(self, frame):
+        self.store.write(frame, self.location, self.property_type, self.scrape_date)
+
+    def close(self):
+        if self.close_store:
+            self.store.close()
+
+
+def make_sink(output_format, output_directory, location, property_type, scrape_date):
+    """
+    Returns the sink collect_real_estate_data() writes a location/property type to.
+
+    Arguments:
+        output_format (str or callable): "csv", "parquet", "feather" or "sqlite" (a ListingStore in output_directory), or a function taking
+            (output_directory, location, property_type, scrape_date) and returning an object with write(frame) and close()
+    """
+    if callable(output_format):
+        return output_format(output_directory, location, property_type, scrape_date)
+    if output_format == "csv":
+        return CsvSink("{output_directory}{location}_{property_type}_{date}.csv".format(location=location, property_type=property_type, date=scrape_date, output_directory=output_directory))
+
+    partition = {"location": location, "property_type": property_type, "scrape_date": scrape_date}
+    if output_format == "parquet":
+        return ParquetSink(output_directory, partition)
+    if output_format == "feather":
+        return FeatherSink(output_directory, partition)
+    if output_format == "sqlite":
+        store = ListingStore("{output_directory}zillow_listings.sqlite".format(output_directory=output_directory))
+        return ListingStoreSink(store, location, property_type, scrape_date, close_store=True)
+    raise TypeError("invalid output_format, must be either 'csv', 'parquet', 'feather' or 'sqlite'")
+
+
+def iter_batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def job_file_prefix(directory, location, property_type, query=None):
+    # the start of the name of a job's files, runs with a different query keep files of their own
+    if query is None or query == SearchQuery():
+        return "{directory}{location}_{property_type}".format(directory=directory, location=location, property_type=property_type)
+    query_hash = hashlib.sha1(json.dumps(query.arguments(), sort_keys=True).encode("utf-8")).hexdigest()[:10]
+    return "{directory}{location}_{property_type}_{query_hash}".format(directory=directory, location=location, property_type=property_type, query_hash=query_hash)
+
+
+def checkpoint_path(output_directory, location, property_type, query=None):
+    # the journal of a crawl, not dated so a crawl running past midnight (or restarted the next day) still finds it
+    return job_file_prefix(output_directory, location, property_type, query) + ".checkpoint.jsonl"
+
+
+def snapshot_path(snapshot_directory, location, property_type, query=None):
+    # the snapshot of the last delta run, a delta run only compares to runs of the same query
+    return job_file_prefix(snapshot_directory, location, property_type, query) + ".snapshot.json"
+
+
+def collect_location_data(location, property_type, output_directory, time_between_scrapes, rate_limiter, driver_pool, cache, resume, output_format, batch_size, scrape_date, partition="dynamic", delta=False, snapshot_directory=None, hoa_fees=False, max_workers=1, metrics_file=None, extra_fields=None, query=None, normalize=True):
+    """
+    Collects and writes out one location/property type job of collect_real_estate_data().
+
+    With delta, listings are compared to the SnapshotStore of the last delta run: only new and
+    changed listings have their building page (rentals) or hoa fee (sales) fetched, the others
+    reuse what the snapshot has. The added/changed/removed listings are written to a changelog
+    and the snapshot is replaced once the job is done.
+
+    Returns:
+        summary (dict): number of listings written, the final min_price/num_listings of the crawl, the building page fetch tiers, with delta the number of listings per "changes" and the "error" the crawl stopped on, if it stopped early
+    """
+    job_name = "{} {}".format(location, property_type)
+
+    checkpoint = None
+    if resume:
+        checkpoint = CrawlCheckpoint(checkpoint_path(output_directory, location, property_type, query))
+
+    snapshot = None
+    if delta:
+        snapshot = SnapshotStore(snapshot_path(snapshot_directory or output_directory, location, property_type, query))
+
+    sink = make_sink(output_format, output_directory, location, property_type, scrape_date)
+    progress = {}
+    fetch_tiers = {}
+    rows_written = 0
+    current_listings = {}
+    changes = []
+    change_counts = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+    unit_store = {}
+    hoa_fee_store = {}
+    url_column = "detailed_url" if property_type == "rent" else "detailUrl"
+    listings = iter_listings(location, property_type, time_between_scrapes=time_between_scrapes, min_price=0, fingerprint=delta, extra_fields=extra_fields, query=query, max_workers=max_workers, rate_limiter=rate_limiter, cache=cache, resume=checkpoint, partition=partition, progress=progress)
+
+    for batch in iter_batches(listings, batch_size):
+        df = pd.DataFrame.from_records(batch)
+
+        unchanged_urls = set()
+        if snapshot is not None:
+            for key, fingerprint, url in zip(df['listing_key'], df['listing_fingerprint'], df[url_column]):
+                key = str(key)
+                change = snapshot.compare(key, fingerprint)
+                change_counts[change] += 1
+                current_listings[key] = {"fingerprint": fingerprint, "detailed_url": url}
+                if change == "unchanged":
+                    unchanged_urls.add(url)
                 else:
-                    building_data = get_units_from_detailed_url(row['detailed_url'])
-                    unit_dicts = []
-
-                    for j in range(0, len(building_data['unit_number'])):
-                        unit_row = building_data.iloc[j]
-
-                        unit_dict = {
-                            "listing_type": "expanded",
-                            "unit_description": row['unit_description'],
-                            "detailed_url": row['detailed_url'],
-                            "latitude": row['latitude'],
-                            "longitude": row['longitude'],
-                            "unit_address": row['unit_address'],
-                            "unit_address_street": row['unit_address_street'],
-                            "unit_city": row['unit_city'],
-                            "unit_zipcode": row['unit_zipcode'],
-                            "beds": unit_row['beds'],
-                            "baths": unit_row['baths'],
-                            "area": unit_row['sqft'],
-                            "price": unit_row['price'],
-                            "unit_number": unit_row['unit_number']
-                        }
-
-                        unit_dicts.append(unit_dict)
-
-                    new_frames.append(pd.DataFrame(unit_dicts))
-
-                    time.sleep(time_to_sleep)
-
-            except Exception as e:
-                print(row['detailed_url'])
-                print(row)
-                print("Error:", e)
-                traceback.print_exc()
-                pass
-    
-    if new_frames:
-        frame = pd.concat([frame] + new_frames, ignore_index=True)
-    
-    return frame
+                    changes.append({"listing_key": key, "detailed_url": url, "change": change})
+            df = df.drop(columns=['listing_key', 'listing_fingerprint'])
+
+        if property_type == "sale":
+            if normalize:
+                df = normalize_frame(df)
+
+            #filters
+            df['zestimate'] = df['zestimate'].fillna(0)
+            df['best_deal'] = df['unformattedPrice'] - df['zestimate']
+
+            if hoa_fees:
+                # listings unchanged since the last snapshot keep their fee
+                if snapshot is not None:
+                    for url in unchanged_urls:
+                        if url in snapshot.hoa_fees:
+                            hoa_fee_store.setdefault(url, snapshot.hoa_fees[url])
+                df['hoa_fee'] = get_hoa_fees(df['detailUrl'], time_between_scrapes, max_workers=max_workers, rate_limiter=rate_limiter, cache=cache, store=hoa_fee_store)
+        else:
+            df = df.reindex(columns=rental_detail_columns + list(extra_fields or {}))
+
+            # buildings of unchanged listings keep the units of the last snapshot
+            if snapshot is not None:
+                for url in unchanged_urls:
+                    if url in snapshot.units:
+                        unit_store.setdefault(url, snapshot.units[url])
+
+            # get additional data for nested apartments
+            with get_metrics().stage("expand"):
+                df = rental_frame_expander(df, time_to_sleep = time_between_scrapes, rate_limiter = rate_limiter, driver_pool = driver_pool, fetch_tiers = fetch_tiers, cache = cache, checkpoint = checkpoint, unit_store = unit_store, max_workers = max_workers)
+
+            # remove nested rows now that we have the expanded data.
+            df = df[df.listing_type != "nested"]
+
+            # Drop the 'listing_type' column
+            df = df.drop(columns=['listing_type'])
+
+            if normalize:
+                df = normalize_frame(df)
+
+        with get_metrics().stage("write"):
+            sink.write(df)
+        rows_written += len(df)
+        get_metrics().increment("rows_written", len(df))
+        if metrics_file is not None:
+            get_metrics().write_prometheus(metrics_file)
+        print("[{}] {} rows written, min_price {} of {} listings".format(job_name, rows_written, progress.get("min_price"), progress.get("num_listings")))
+
+    sink.close()
+    print(location, property_type, progress.get("min_price"), progress.get("num_listings"))
+    if fetch_tiers:
+        tier_counts = pd.Series(list(fetch_tiers.values()), dtype=object).value_counts().to_dict()
+        print("Building pages served by:", tier_counts)
+
+    if snapshot is not None:
+        if progress.get("error") is None:
+            for key, previous in snapshot.listings.items():
+                if key not in current_listings:
+                    change_counts["removed"] += 1
+                    changes.append({"listing_key": key, "detailed_url": previous["detailed_url"], "change": "removed"})
+        else:
+            # the crawl stopped early, listings it didn't get to aren't removed, they stay in the snapshot
+            for key, previous in snapshot.listings.items():
+                current_listings.setdefault(key, previous)
+            for url, units in snapshot.units.items():
+                unit_store.setdefault(url, units)
+            for url, fee in snapshot.hoa_fees.items():
+                hoa_fee_store.setdefault(url, fee)
+
+        pd.DataFrame(changes, columns=["listing_key", "detailed_url", "change"]).to_csv("{prefix}_{date}_changes.csv".format(prefix=job_file_prefix(output_directory, location, property_type, query), date=scrape_date), index=False)
+        snapshot.save(current_listings, unit_store, hoa_fee_store)
+        print("[{}] changes since last snapshot: {}".format(job_name, change_counts))
+
+    if checkpoint is not None:
+        # a crawl that stopped early keeps its journal, so the next run with resume carries on from it
+        if checkpoint.state is not None and checkpoint.state["done"] and progress.get("error") is None:
+            checkpoint.remove()
+        else:
+            print("[{}] crawl stopped early, resume from {}".format(job_name, checkpoint.path))
+
+    summary = {
+        "rows": rows_written,
+        "min_price": progress.get("min_price"),
+        "num_listings": progress.get("num_listings"),
+        "fetch_tiers": fetch_tiers,
+    }
+    if snapshot is not None:
+        summary["changes"] = change_counts
+    if progress.get("error") is not None:
+        summary["error"] = progress["error"]
+    return summary
 
 
-def collect_real_estate_data(locations, property_types = ["rent", "sale"], output_directory = "./"):
+def collect_real_estate_data(locations, property_types = ["rent", "sale"], output_directory = "./", time_between_scrapes = 120, rate_limiter = None, driver_pool = None, cache = None, resume = False, output_format = "csv", batch_size = 1000, max_jobs = 1, partition = "dynamic", delta = False, snapshot_directory = None, hoa_fees = False, max_workers = 1, metrics_file = None, extra_fields = None, query = None, normalize = True):
     '''
 
     Collects real estate data for target locations and property types.
+
+    Listings are written out in batches while the crawl is running, rather than all at once at the end.
+    Each location/property type is a separate job, with max_jobs > 1 they run concurrently, sharing
+    rate_limiter so the run as a whole stays within the same request budget. A job that fails doesn't
+    stop the others.
     
     Arguments:
         locations (list): a list of locations to collect
         property_types (list): toggle whether or not to collect rental/sale or both
         output_directory (str): where output files should be written to
+        time_between_scrapes (int): number of seconds between requests, used when no rate_limiter is given
+        rate_limiter (RateLimiter): limiter shared by every search, detail page and browser request of the run, an AdaptiveRateLimiter finds the fastest rate zillow tolerates and reports it at the end
+        driver_pool (DriverPool): browsers shared by the selenium page loads of the run, defaults to a pool with a browser per job
+        cache (ResponseCache): cache of fetched pages, lets a rerun replay pages instead of downloading them again
+        resume (bool): checkpoint each location/property type to a journal in output_directory and resume from it if the run was interrupted or stopped on an error, the journal (named after the location, property type and query) is removed once the crawl is complete
+        output_format (str or callable): "csv" (one file per location/property type), "parquet" or "feather" (partitioned by location, property type and scrape date) or "sqlite" (a ListingStore with the price history of every listing), see make_sink()
+        batch_size (int): number of listings written out at a time
+        max_jobs (int): number of location/property type jobs to run at the same time
+        max_workers (int): number of search pages and building pages each job fetches at the same time, all within rate_limiter
+        metrics_file (str): rewrite the stage timings and counters of get_metrics() (see CrawlMetrics, reset at the start of every run) to this file, in the prometheus text format, after every batch
+        extra_fields (dict): fields of the search results to add to the output, column -> path ("hdpData.homeInfo.homeType") or (path, coerce), see make_schema()
+        query (SearchQuery): filters zillow applies to every search (ie. SearchQuery(min_beds=2, max_price=6000)), so only matching listings are fetched
+        normalize (bool): store prices, beds/baths/area, coordinates and cities/zip codes as typed columns (see normalize_frame()) instead of as scraped
+        partition (str): how each crawl splits up the city, "dynamic", "bisect" or "tiles" (see zillow_scraper(), only "dynamic" can be resumed)
+        delta (bool): only fetch building pages/hoa fees of listings that are new or changed since the last delta run, writing the added/changed/removed listings to a changelog in output_directory
+        snapshot_directory (str): where delta keeps the snapshot of each location/property type, defaults to output_directory
+        hoa_fees (bool): add the "hoa_fee" of each sale listing (see get_hoa_fees())
+    Returns:
+        results (dict): (location, property_type) -> summary of the job, with "status" either "done", "partial" (the crawl stopped early on the "error", what it collected was written) or "failed" (and the "error")
     '''
-    for location in locations:
-        for property_type in property_types:
-            data_dict = zillow_scraper(city=location, property_type=property_type, time_between_scrapes=120, testing=False, min_price=0)
-            data = data_dict["data_list"]
-            min_price = data_dict["min_price"]
-            num_listings = data_dict["num_listings"]
-            print(location, property_type, min_price, num_listings)
-            df = pd.DataFrame()
-
-            if property_type == "sale":
-                # extract into a table
-                df = make_frame_sales(df, data)
-
-                #drop cols
-                df = df.drop('hdpData', 1) #remove this line to see a whole bunch of other random cols, in dict format
-
-                #drop dupes
-                df = df.drop_duplicates(subset='zpid', keep="last")
-
-                #filters
-                df['zestimate'] = df['zestimate'].fillna(0)
-                df['best_deal'] = df['unformattedPrice'] - df['zestimate']
-            else:
-                # convert the rental data json into a dataframe
-                df = make_frame_rentals_detail(df, data)
+    if rate_limiter is None:
+        rate_limiter = RateLimiter.from_interval(time_between_scrapes)
 
-                # get rid of duplicate rows (since some may be collected more than once)
-                df = df.drop_duplicates()
+    if driver_pool is None and max_jobs > 1:
+        driver_pool = DriverPool(max_drivers=max_jobs)
+        atexit.register(driver_pool.close)
 
-                # get additional data for nested apartments
-                df = rental_frame_expander(df, time_to_sleep = 120)
+    # each run reports its own timings, counters and listings per second, measured from its own start
+    get_metrics().reset()
+    if isinstance(rate_limiter, AdaptiveRateLimiter):
+        # a limiter reused from an earlier run publishes the rates it carries over again
+        rate_limiter.set_rate(rate_limiter.requests_per_second)
+        if rate_limiter.sustainable_rate is not None:
+            get_metrics().set_gauge("sustainable_requests_per_second", rate_limiter.sustainable_rate)
 
-                # remove nested rows now that we have the expanded data.
-                df = df[df.listing_type != "nested"]
+    todays_date = time.strftime("%Y-%m-%d")
 
-                # Drop the 'listing_type' column
-                df = df.drop(columns=['listing_type'])
+    jobs = [(location, property_type) for location in locations for property_type in property_types]
+    results = {}
 
-            
-            df.to_csv("{output_directory}{location}_{property_type}_{date}.csv".format(location=location, property_type=property_type, date=todays_date, output_directory=output_directory))
+    def run_job(job):
+        location, property_type = job
+        start_time = time.monotonic()
+        try:
+            summary = collect_location_data(location, property_type, output_directory, time_between_scrapes, rate_limiter, driver_pool, cache, resume, output_format, batch_size, todays_date, partition=partition, delta=delta, snapshot_directory=snapshot_directory, hoa_fees=hoa_fees, max_workers=max_workers, metrics_file=metrics_file, extra_fields=extra_fields, query=query, normalize=normalize)
+            # a crawl that stopped on an error still writes what it collected
+            summary["status"] = "partial" if "error" in summary else "done"
+            if "error" in summary:
+                print("[{} {}] stopped early, only part of the listings were written:".format(location, property_type), summary["error"])
+        except Exception as e:
+            print("[{} {}] failed:".format(location, property_type), e)
+            traceback.print_exc()
+            summary = {"status": "failed", "error": e}
+        summary["seconds"] = time.monotonic() - start_time
+        results[job] = summary
+
+    if max_jobs <= 1:
+        for job in jobs:
+            run_job(job)
+    else:
+        with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+            list(executor.map(run_job, jobs))
 
+    if isinstance(rate_limiter, AdaptiveRateLimiter):
+        rate = rate_limiter.summary()
+        # the limiter may be older than this run, the achieved rate is that of the run's own ok responses
+        run_metrics = get_metrics().summary()
+        outcomes = {outcome: run_metrics["counters"]["responses_" + outcome] for outcome in rate["outcomes"]}
+        achieved_rate = outcomes["ok"] / run_metrics["seconds"]
+        get_metrics().set_gauge("achieved_requests_per_second", achieved_rate)
+        print("Request rate: {:.3f}/s achieved, sustainable {}, responses {}".format(
+            achieved_rate, "unknown" if rate["sustainable_rate"] is None else "{:.3f}/s".format(rate["sustainable_rate"]), outcomes))
 
-def get_hoa_fee(url):
-    try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Accept-Language": "en-US,en;q=0.9",
-        }
+    if metrics_file is not None:
+        get_metrics().write_prometheus(metrics_file)
+    logger.info("crawl metrics: %s", get_metrics().summary())
 
-        r = requests.get(url, headers=headers)
+    return {job: results[job] for job in jobs}
 
-        html_page = r.text
 
-        # Initialize a BeautifulSoup object
-        soup = BeautifulSoup(html_page, 'html.parser')
+# the listing's json in __NEXT_DATA__ is itself stored as an escaped json string, so the quotes may be escaped
+hoa_fee_pattern = re.compile(r'\\?"monthlyHoaFee\\?"\s*:\s*(\d+(?:\.\d+)?)')
 
-        # Find the span containing "monthly HOA fee"
-        target_span = soup.find('span', string=re.compile(r'monthly HOA fee'))
 
-        if target_span:
-            
-            text_content = target_span.string
-            if text_content:
-                text_content = text_content.replace("$", "").replace(",", "").replace(" monthly HOA fee", "")
-                number = float(text_content)
-            # Extract the number from the string
-            #number_match = re.search(r'\$(\d+)', text_content)
-            
-            if number:
-                #number = int(number_match.group(1))
-                return number
-            else:
-                return None
+def extract_gdp_client_cache(data):
+    if isinstance(data, dict):
+        if "gdpClientCache" in data:
+            return data["gdpClientCache"]
         else:
+            for key, value in data.items():
+                result = extract_gdp_client_cache(value)
+                if result is not None:
+                    return result
+    elif isinstance(data, list):
+        for item in data:
+            result = extract_gdp_client_cache(item)
+            if result is not None:
+                return result
+    return None
+
+
+def extract_listing_property(data):
+    # the listing's own property record, gdpClientCache maps each query of the page (a json string) to its result
+    client_cache = extract_gdp_client_cache(data)
+    if isinstance(client_cache, str):
+        client_cache = json.loads(client_cache)
+    if not isinstance(client_cache, dict):
+        return None
+    for value in client_cache.values():
+        if isinstance(value, dict) and isinstance(value.get("property"), dict):
+            return value["property"]
+    return None
+
+
+def extract_hoa_fee(html_content):
+    """
+    Reads the monthly HOA fee of a listing page.
+
+    The fee comes from the listing's property record in the page's __NEXT_DATA__ json, where a
+    null monthlyHoaFee means the listing has no HOA. Only pages without that record fall back
+    on a regex over the page and then on its "monthly HOA fee" text.
+
+    Returns:
+        fee (float): the monthly fee, None if the listing has none
+    """
+    try:
+        data = slice_next_data(html_content)
+    except ValueError:
+        data = None
+    listing = extract_listing_property(data) if data is not None else None
+    if listing is not None:
+        fee = listing.get("monthlyHoaFee")
+        return float(fee) if fee else None
+
+    if isinstance(html_content, bytes):
+        html_content = html_content.decode("utf-8", errors="replace")
+
+    match = hoa_fee_pattern.search(html_content)
+    if match:
+        number = float(match.group(1))
+        return number if number else None
+
+    # Initialize a BeautifulSoup object
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    # Find the span containing "monthly HOA fee"
+    target_span = soup.find('span', string=re.compile(r'monthly HOA fee'))
+
+    if target_span and target_span.string:
+        text_content = target_span.string.replace("$", "").replace(",", "").replace(" monthly HOA fee", "")
+        number = float(text_content)
+        if number:
+            return number
+    return None
+
+
+def get_hoa_fee(url, rate_limiter=None, cache=None):
+    try:
+        r = make_request_with_backoff(urllib.parse.urljoin(base_url, url), headers=headers, rate_limiter=rate_limiter, cache=cache)
+        if r is None:
             return None
 
+        return extract_hoa_fee(r.text)
+
     except Exception as e:
         print(e)
         return None
 
+
+def get_hoa_fees(urls, time_between_scrapes=120, max_workers=1, rate_limiter=None, cache=None, store=None, save_every=10):
+    """
+    Gets the monthly HOA fee of many listings.
+
+    Each url is only fetched once, however many times it appears, and max_workers pages are
+    fetched at a time within rate_limiter. Fees already in store are reused and the fees
+    fetched are added to it. Give store as the path of a json file to memoize fees across
+    runs: it is read if it exists and rewritten every save_every new fees, and once more when
+    the function returns or is interrupted, so a crash only loses the last few fees.
+    Pages that fail to download aren't stored, so they are retried next time.
+    (collect_real_estate_data() keeps fees across runs in its delta snapshots instead.)
+
+    Arguments:
+        urls (list or pd.Series): listing urls, ie. the "detailUrl" column of the sale data
+        time_between_scrapes (int): number of seconds between requests, used when no rate_limiter is given
+        max_workers (int): number of pages fetched at the same time
+        rate_limiter (RateLimiter): limiter shared with the rest of the run
+        cache (ResponseCache): cache of fetched pages
+        store (dict or str): url -> fee of the listings already looked up, or the path of a json file holding it
+        save_every (int): number of new fees between rewrites of the store file
+    Returns:
+        hoa_fees (pd.Series): the fee of each url (None when the listing has none), aligned to urls
+    """
+    if rate_limiter is None:
+        rate_limiter = RateLimiter.from_interval(time_between_scrapes)
+    store_path = None
+    if isinstance(store, str):
+        store_path = store
+        store = {}
+        if os.path.exists(store_path):
+            with open(store_path) as f:
+                store = json.load(f)
+    elif store is None:
+        store = {}
+
+    index = urls.index if isinstance(urls, pd.Series) else None
+    urls = list(urls)
+    urls_to_fetch = [url for url in dict.fromkeys(urls) if url not in store]
+    store_lock = threading.Lock()
+    unsaved = [0]
+
+    def save_store():
+        # replaced in one go, an interrupted write leaves the previous fees in place
+        with store_lock:
+            if store_path is None or not unsaved[0]:
+                return
+            temp_path = store_path + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump(store, f)
+            os.replace(temp_path, store_path)
+            unsaved[0] = 0
+
+    def fetch_hoa_fee(url):
+        try:
+            # building urls (/b/...) are relative
+            r = make_request_with_backoff(urllib.parse.urljoin(base_url, url), headers=headers, rate_limiter=rate_limiter, cache=cache)
+            if r is not None:
+                fee = extract_hoa_fee(r.text)
+                with store_lock:
+                    store[url] = fee
+                    unsaved[0] += 1
+                    save_now = unsaved[0] >= save_every
+                if save_now:
+                    save_store()
+        except Exception as e:
+            print(url, e)
+
+    executor = None
+    try:
+        if max_workers > 1 and len(urls_to_fetch) > 1:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            list(executor.map(fetch_hoa_fee, urls_to_fetch))
+        else:
+            for url in urls_to_fetch:
+                fetch_hoa_fee(url)
+    finally:
+        if executor is not None:
+            # on an interrupt, don't start the pages still queued
+            executor.shutdown(cancel_futures=True)
+        save_store()
+
+    return pd.Series([store.get(url) for url in urls], index=index, dtype=object, name="hoa_fee")